@@ -2,6 +2,7 @@
 from core import (
     get_hardware_topology,
     execute_m_logic,
+    execute_m_logic_async,
     read_vm_state,
     encode_varint,
     decode_varint,
@@ -12,6 +13,7 @@ from core import (
 __all__ = [
     "get_hardware_topology",
     "execute_m_logic",
+    "execute_m_logic_async",
     "read_vm_state",
     "encode_varint",
     "decode_varint",
@@ -1,72 +1,86 @@
 # M-Language Core Module
 # 核心实现：编码/解码、串口通信、协议处理
 
+import asyncio
+import functools
 import os
+import re
+import struct
+import threading
 import time
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 
 try:
     import serial  # type: ignore
 except Exception:
     serial = None
 
+try:
+    import serial.tools.list_ports as _list_ports  # type: ignore
+except Exception:
+    _list_ports = None
+
 
 # =============================================================================
 # 设备定义
 # =============================================================================
 
-def get_hardware_topology() -> Dict[str, Any]:
-    """获取设备清单"""
-    return {
-        "controller": {
-            "name": "NodeMCU (ESP8266)",
-            "analog_in": "A0",
-            "digital_pins": {
-                "D1": "GPIO5",
-                "D2": "GPIO4",
-                "D4": "GPIO2"
-            }
+# 设备拓扑由固件约定决定，是静态的：导入时构造一次，调用方只读不改。
+_HARDWARE_TOPOLOGY: Dict[str, Any] = {
+    "controller": {
+        "name": "NodeMCU (ESP8266)",
+        "analog_in": "A0",
+        "digital_pins": {
+            "D1": "GPIO5",
+            "D2": "GPIO4",
+            "D4": "GPIO2"
+        }
+    },
+    "devices": [
+        {
+            "id": 1,
+            "type": "SENSOR",
+            "name": "Water_Level",
+            "signal": "AO",
+            "pin": "A0",
+            "unit": "raw_0_1024"
         },
-        "devices": [
-            {
-                "id": 1,
-                "type": "SENSOR",
-                "name": "Water_Level",
-                "signal": "AO",
-                "pin": "A0",
-                "unit": "raw_0_1024"
-            },
-            {
-                "id": 2,
-                "type": "SENSOR",
-                "name": "DHT11_Temp",
-                "pin": "D4",
-                "unit": "Celsius"
-            },
-            {
-                "id": 3,
-                "type": "SENSOR",
-                "name": "DHT11_Humidity",
-                "pin": "D4",
-                "unit": "Percent"
-            },
-            {
-                "id": 5,
-                "type": "ACTUATOR",
-                "name": "Relay_1",
-                "pin": "D1",
-                "desc": "Relay channel 1"
-            },
-            {
-                "id": 6,
-                "type": "ACTUATOR",
-                "name": "Relay_2",
-                "pin": "D2",
-                "desc": "Relay channel 2"
-            }
-        ],
-        "auth_required": [70, 71]
-    }
+        {
+            "id": 2,
+            "type": "SENSOR",
+            "name": "DHT11_Temp",
+            "pin": "D4",
+            "unit": "Celsius"
+        },
+        {
+            "id": 3,
+            "type": "SENSOR",
+            "name": "DHT11_Humidity",
+            "pin": "D4",
+            "unit": "Percent"
+        },
+        {
+            "id": 5,
+            "type": "ACTUATOR",
+            "name": "Relay_1",
+            "pin": "D1",
+            "desc": "Relay channel 1"
+        },
+        {
+            "id": 6,
+            "type": "ACTUATOR",
+            "name": "Relay_2",
+            "pin": "D2",
+            "desc": "Relay channel 2"
+        }
+    ],
+    "auth_required": [70, 71]
+}
+
+
+def get_hardware_topology() -> Dict[str, Any]:
+    """获取设备清单（共享的只读字典，调用方不要修改）"""
+    return _HARDWARE_TOPOLOGY
 
 
 # =============================================================================
@@ -77,6 +91,11 @@ def _encode_uvarint(value: int) -> bytes:
     """Encode unsigned varint."""
     if value < 0:
         raise ValueError("uvarint cannot be negative")
+    # 快速路径：绝大多数 M-Token 是单字节操作码/小操作数
+    if value < 0x80:
+        return bytes((value,))
+    if value < 0x4000:
+        return bytes(((value & 0x7F) | 0x80, value >> 7))
     out = bytearray()
     while value > 0x7F:
         out.append((value & 0x7F) | 0x80)
@@ -90,23 +109,57 @@ def _encode_zigzag64(n: int) -> int:
     return (n << 1) ^ (n >> 63)
 
 
-def _encode_token(val: int) -> bytes:
-    """Encode a single token (opcode or operand)."""
-    if val < 0:
-        return _encode_uvarint(_encode_zigzag64(val))
-    return _encode_uvarint(val)
-
-
 def encode_varint(tokens: List[int]) -> bytes:
     """Encode M-Token list to bytecode."""
-    buf = bytearray()
-    for t in tokens:
-        buf.extend(_encode_token(int(t)))
-    return bytes(buf)
+    # 全部 token 都在 0-127 时 varint 编码就是逐字节拷贝（max/min/bytes 均在 C 层完成）
+    if tokens and max(tokens) < 0x80 and min(tokens) >= 0:
+        return bytes(tokens)
+    # 按最坏情况（uint64 varint 最长 10 字节）一次性预分配，写入过程不再扩容
+    buf = bytearray(len(tokens) * 10)
+    off = 0
+    for v in tokens:
+        if v < 0:
+            v = (v << 1) ^ (v >> 63)
+        if v < 0x80:
+            buf[off] = v
+            off += 1
+        elif v < 0x4000:
+            buf[off] = (v & 0x7F) | 0x80
+            buf[off + 1] = v >> 7
+            off += 2
+        elif v < 1 << 64:
+            while v > 0x7F:
+                buf[off] = (v & 0x7F) | 0x80
+                v >>= 7
+                off += 1
+            buf[off] = v
+            off += 1
+        else:
+            # 超过 64 位的 Python int：在 off 处插入，剩余预分配空间原样后移
+            enc = _encode_uvarint(v)
+            buf[off:off] = enc
+            off += len(enc)
+    return bytes(memoryview(buf)[:off])
 
 
 def _decode_uvarint(data: bytes, offset: int) -> Tuple[int, int]:
     """Decode unsigned varint, return (value, next_offset)."""
+    # 展开 1~3 字节的常见情况（覆盖 0..2^21-1），直线代码无循环计数
+    n = len(data)
+    if offset + 2 < n:
+        b0 = data[offset]
+        if b0 < 0x80:
+            return b0, offset + 1
+        b1 = data[offset + 1]
+        if b1 < 0x80:
+            return (b0 & 0x7F) | (b1 << 7), offset + 2
+        b2 = data[offset + 2]
+        if b2 < 0x80:
+            return (b0 & 0x7F) | ((b1 & 0x7F) << 7) | (b2 << 14), offset + 3
+    elif offset < n and data[offset] < 0x80:
+        return data[offset], offset + 1
+
+    # 通用路径：更长的值或缓冲区尾部
     shift = 0
     result = 0
     i = offset
@@ -122,17 +175,97 @@ def _decode_uvarint(data: bytes, offset: int) -> Tuple[int, int]:
     raise ValueError("bad varint")
 
 
+def _decode_two_uvarints(data: bytes) -> Tuple[int, int, int]:
+    """Decode the two leading uvarints in one walk, return (first, second, next_offset)."""
+    n = len(data)
+    if n >= 2 and data[0] < 0x80 and data[1] < 0x80:
+        return data[0], data[1], 2
+    values = [0, 0]
+    i = 0
+    for k in (0, 1):
+        result = 0
+        shift = 0
+        while True:
+            if i >= n or shift > 63:
+                raise ValueError("bad varint")
+            b = data[i]
+            i += 1
+            result |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        values[k] = result
+    return values[0], values[1], i
+
+
 def decode_varint(data: bytes) -> List[int]:
     """Decode bytecode to M-Token list."""
-    tokens = []
-    offset = 0
-    while offset < len(data):
-        value, next_offset = _decode_uvarint(data, offset)
-        tokens.append(value)
-        offset = next_offset
+    # 没有任何续位（全部字节 < 0x80）时每个字节就是一个 token；
+    # bytes.isascii() 在 C 层按机器字批量检查。memoryview、list[int] 等走下面的通用循环
+    if isinstance(data, (bytes, bytearray)) and data.isascii():
+        return list(data)
+    # 解码循环内联，不再逐 token 调用 _decode_uvarint
+    tokens: List[int] = []
+    append = tokens.append
+    n = len(data)
+    i = 0
+    while i < n:
+        b = data[i]
+        i += 1
+        if b < 0x80:
+            append(b)
+            continue
+        result = b & 0x7F
+        shift = 7
+        while True:
+            if i >= n or shift > 63:
+                raise ValueError("bad varint")
+            b = data[i]
+            i += 1
+            result |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        append(result)
     return tokens
 
 
+# VM 故障码 -> 名称，下标即故障码（0 表示无故障，不会出现在故障响应里）
+_FAULT_NAMES = (
+    None,
+    "STACK_OVERFLOW",       # 1
+    "STACK_UNDERFLOW",      # 2
+    "RET_STACK_OVERFLOW",   # 3
+    "RET_STACK_UNDERFLOW",  # 4
+    "LOCALS_OOB",           # 5
+    "GLOBALS_OOB",          # 6
+    "PC_OOB",               # 7
+    "DIV_BY_ZERO",          # 8
+    "MOD_BY_ZERO",          # 9
+    "UNKNOWN_OP",           # 10
+    "STEP_LIMIT",           # 11
+    "GAS_EXHAUSTED",        # 12
+    "BAD_ENCODING",         # 13
+    "UNAUTHORIZED",         # 14
+    "TYPE_MISMATCH",        # 15
+    "INDEX_OOB",            # 16
+    "BAD_ARG",              # 17
+    "OOM",                  # 18
+    "ASSERT_FAILED",        # 19
+    "BREAKPOINT",           # 20
+    "DEBUG_STEP",           # 21
+    "CALL_DEPTH_LIMIT",     # 22
+)
+
+
+def _fault_name(code: int) -> str:
+    if 0 < code < len(_FAULT_NAMES):
+        return _FAULT_NAMES[code]
+    if code == 99:
+        return "GAS_LIMIT"
+    return f"UNKNOWN_{code}"
+
+
 def parse_response(payload: bytes) -> Dict[str, Any]:
     """Parse VM response: [result/fault varint][steps varint][flag]."""
     if len(payload) < 1:
@@ -141,8 +274,7 @@ def parse_response(payload: bytes) -> Dict[str, Any]:
     flag = payload[-1]
 
     try:
-        first, off = _decode_uvarint(payload, 0)
-        second, off2 = _decode_uvarint(payload, off)
+        first, second, _ = _decode_two_uvarints(payload)
     except Exception as exc:
         return {"error": f"bad response varint: {exc}"}
 
@@ -155,37 +287,12 @@ def parse_response(payload: bytes) -> Dict[str, Any]:
             "fault": "NONE"
         }
     else:
-        fault_names = {
-            1: "STACK_OVERFLOW",
-            2: "STACK_UNDERFLOW",
-            3: "RET_STACK_OVERFLOW",
-            4: "RET_STACK_UNDERFLOW",
-            5: "LOCALS_OOB",
-            6: "GLOBALS_OOB",
-            7: "PC_OOB",
-            8: "DIV_BY_ZERO",
-            9: "MOD_BY_ZERO",
-            10: "UNKNOWN_OP",
-            11: "STEP_LIMIT",
-            12: "GAS_EXHAUSTED",
-            13: "BAD_ENCODING",
-            14: "UNAUTHORIZED",
-            15: "TYPE_MISMATCH",
-            16: "INDEX_OOB",
-            17: "BAD_ARG",
-            18: "OOM",
-            19: "ASSERT_FAILED",
-            20: "BREAKPOINT",
-            21: "DEBUG_STEP",
-            22: "CALL_DEPTH_LIMIT",
-            99: "GAS_LIMIT"
-        }
         return {
             "result": None,
             "fault_code": first,
             "pc": second,
             "completed": False,
-            "fault": fault_names.get(first, f"UNKNOWN_{first}")
+            "fault": _fault_name(first)
         }
 
 
@@ -193,8 +300,26 @@ def parse_response(payload: bytes) -> Dict[str, Any]:
 # 串口通信
 # =============================================================================
 
+# 串口连接缓存：按 (port, baud) 复用已打开的连接，避免每次调用都 open/settle/close。
+# _serial_lock 同时串行化整个收发往返（同一串口上的请求/响应帧不能交错）。
+_SERIAL_CACHE: Dict[Tuple[str, int], Any] = {}
+_serial_lock = threading.Lock()
+_serial_dirty = False  # 上一次往返超时，缓冲区里可能残留迟到的响应字节
+_FRAME_HDR = struct.Struct("<I")  # 帧长度前缀：uint32 小端
+
+
+def _drop_serial(key: Tuple[str, int]) -> None:
+    ser = _SERIAL_CACHE.pop(key, None)
+    if ser is not None:
+        try:
+            ser.close()
+        except Exception:
+            pass
+
+
 def _serial_send(bytecode: bytes, timeout_ms: int) -> Dict[str, Any]:
     """Send bytecode to ESP8266 and get response."""
+    global _serial_dirty
     port = os.getenv("MCP_SERIAL_PORT", "")
     baud = int(os.getenv("MCP_BAUD", "115200"))
 
@@ -203,48 +328,87 @@ def _serial_send(bytecode: bytes, timeout_ms: int) -> Dict[str, Any]:
     if serial is None:
         return {"error": "pyserial not installed", "code": "MISSING_DEP"}
 
-    try:
-        ser = serial.Serial(port=port, baudrate=baud, timeout=timeout_ms / 1000.0)
-    except Exception as exc:
-        return {"error": f"cannot open port {port}: {exc}", "code": "PORT_ERROR"}
-
-    try:
-        time.sleep(0.05)  # Settle time
-        ser.reset_input_buffer()
-        ser.reset_output_buffer()
+    key = (port, baud)
+    with _serial_lock:
+        ser = _SERIAL_CACHE.get(key)
+        if ser is None or not ser.is_open:
+            # 串口切换后旧连接不再使用，先释放
+            for stale in list(_SERIAL_CACHE):
+                _drop_serial(stale)
+            try:
+                ser = serial.Serial(port=port, baudrate=baud, timeout=timeout_ms / 1000.0)
+            except Exception as exc:
+                return {"error": f"cannot open port {port}: {exc}", "code": "PORT_ERROR"}
+            _SERIAL_CACHE[key] = ser
+            _serial_dirty = True
+            time.sleep(0.05)  # Settle time (only after open)
+        else:
+            ser.timeout = timeout_ms / 1000.0
 
-        # Send length prefix + bytecode
-        ser.write(len(bytecode).to_bytes(4, "little"))
-        ser.write(bytecode)
+        try:
+            if _serial_dirty:
+                ser.reset_input_buffer()
+                ser.reset_output_buffer()
+                _serial_dirty = False
 
-        # Read response
-        resp_len_raw = ser.read(4)
-        if len(resp_len_raw) < 4:
-            return {"error": "timeout reading response length", "code": "TIMEOUT_LEN"}
+            # Send length prefix + bytecode in a single write
+            ser.write(_FRAME_HDR.pack(len(bytecode)) + bytecode)
 
-        resp_len = int.from_bytes(resp_len_raw, "little")
-        resp = ser.read(resp_len)
-        if len(resp) < resp_len:
-            return {"error": "timeout reading response payload", "code": "TIMEOUT_RESP"}
+            # Read response
+            resp_len_raw = ser.read(4)
+            if len(resp_len_raw) < 4:
+                _serial_dirty = True
+                return {"error": "timeout reading response length", "code": "TIMEOUT_LEN"}
 
-        return parse_response(resp)
+            resp_len = _FRAME_HDR.unpack(resp_len_raw)[0]
+            resp = ser.read(resp_len)
+            if len(resp) < resp_len:
+                _serial_dirty = True
+                return {"error": "timeout reading response payload", "code": "TIMEOUT_RESP"}
+        except Exception as exc:
+            # 连接已不可用：关闭并移出缓存，下次调用重新打开
+            _drop_serial(key)
+            return {"error": f"serial I/O error on {port}: {exc}", "code": "PORT_ERROR"}
 
-    finally:
-        ser.close()
+    return parse_response(resp)
 
 
 # =============================================================================
 # M-Token 执行
 # =============================================================================
 
+def _as_bytes(tokens: Any) -> Optional[bytes]:
+    """list/tuple 的 token 全部是 0-255 的整数时返回等价的 bytes，否则返回 None（交给逐项循环）。"""
+    if isinstance(tokens, (bytes, bytearray)):
+        return tokens
+    if not isinstance(tokens, (list, tuple)):
+        # 生成器等一次性可迭代对象不能先试 bytes() 再回退，否则会被提前耗尽
+        return None
+    try:
+        return bytes(tokens)
+    except (TypeError, ValueError):
+        return None
+
+
+_IO_OPS = frozenset((70, 71))  # IOW, IOR
+
+
 def uses_io(tokens: List[int]) -> bool:
     """Check if token list contains IO operations."""
-    io_ops = {70, 71}  # IOW, IOR
-    return any(int(t) in io_ops for t in tokens)
+    b = _as_bytes(tokens)
+    if b is not None:
+        # bytes 的成员判断走 C 层 memchr
+        return 70 in b or 71 in b  # IOW, IOR
+    return any(int(t) in _IO_OPS for t in tokens)
 
 
 def needs_capability(tokens: List[int], cap_id: int) -> bool:
     """Check if token list contains GTWAY with specific capability."""
+    b = _as_bytes(tokens)
+    if b is not None and type(cap_id) is int:
+        if not 0 <= cap_id <= 255:
+            return False
+        return b.find(bytes((80, cap_id))) != -1
     for i, t in enumerate(tokens):
         if t == 80 and i + 1 < len(tokens):
             if tokens[i + 1] == cap_id:
@@ -252,23 +416,18 @@ def needs_capability(tokens: List[int], cap_id: int) -> bool:
     return False
 
 
-def execute_m_logic(m_tokens: List[Any], timeout_ms: int = 5000) -> Dict[str, Any]:
-    """
-    Execute M-Token bytecode on ESP8266.
-
-    Args:
-        m_tokens: List of M-Token opcodes/operands (integers only)
-        timeout_ms: Timeout in milliseconds
+# 75-79 为 Core 指令集保留/未定义操作码
+_RESERVED_RE = re.compile(rb"[\x4b-\x4f]")
+# GTWAY / IOW / IOR 后跟的操作数（前瞻捕获，操作码之间可相邻）
+_CAP_IO_RE = re.compile(rb"[\x46\x47\x50](?=(.))", re.DOTALL)
+# 单个 token (0-255) 的 varint 编码表
+_TOKEN_VARINT = tuple(bytes((t,)) if t < 0x80 else bytes(((t & 0x7F) | 0x80, t >> 7)) for t in range(256))
 
-    Returns:
-        Dict with result/fault info
-    """
-    # Validate input
-    if not isinstance(m_tokens, list) or not m_tokens:
-        return {"error": "m_tokens must be a non-empty list", "code": "INVALID_INPUT"}
 
+def _token_error(m_tokens: List[Any]) -> Dict[str, Any]:
+    """逐项诊断非法 token，按原有优先级返回第一条错误（字符串 > 类型 > 范围 > 保留码）。"""
     # Check for string arguments (common AI mistake)
-    for i, t in enumerate(m_tokens):
+    for t in m_tokens:
         if isinstance(t, str):
             return {
                 "error": "M-Tokens must be integers only, not strings",
@@ -290,29 +449,75 @@ def execute_m_logic(m_tokens: List[Any], timeout_ms: int = 5000) -> Dict[str, An
                 "hint": "Core指令集: 10-18控制流, 30-33变量, 40-44比较, 50-58算术, 60-63数组, 64-66栈操作, 70-71硬件IO, 80-83系统",
                 "m_tokens_received": m_tokens
             }
+    return {"error": "invalid m_tokens", "code": "INVALID_INPUT"}
+
+
+def execute_m_logic(m_tokens: List[Any], timeout_ms: int = 5000) -> Dict[str, Any]:
+    """
+    Execute M-Token bytecode on ESP8266.
+
+    Args:
+        m_tokens: List (or tuple) of M-Token opcodes/operands (integers only)
+        timeout_ms: Timeout in milliseconds
+
+    Returns:
+        Dict with result/fault info
+    """
+    # Validate input
+    if not isinstance(m_tokens, (list, tuple)) or not m_tokens:
+        return {"error": "m_tokens must be a non-empty list", "code": "INVALID_INPUT"}
+
+    # 收窄为 bytes：每个 token 一个字节，之后的校验/扫描/编码都走 C 层。
+    # 非整数抛 TypeError，超出 0-255 抛 ValueError，交给 _token_error 给出详细错误。
+    try:
+        code = bytes(m_tokens)
+    except (TypeError, ValueError):
+        return _token_error(m_tokens)
+    if _RESERVED_RE.search(code):
+        return _token_error(m_tokens)
+
+    gtway_caps = set()
+    io_devices: List[int] = []
+    for m in _CAP_IO_RE.finditer(code):
+        if code[m.start()] == 80:  # GTWAY
+            gtway_caps.add(code[m.start() + 1])
+        else:  # IOW, IOR
+            io_devices.append(code[m.start() + 1])
 
     # Check IO authorization
-    if uses_io(m_tokens):
-        # Find which device is being accessed
-        for i, t in enumerate(m_tokens):
-            if t in (70, 71) and i + 1 < len(m_tokens):
-                device_id = m_tokens[i + 1]
-                if not needs_capability(m_tokens, device_id):
-                    return {
-                        "error": f"IO operation on device {device_id} requires GTWAY capability",
-                        "code": "UNAUTHORIZED_IO",
-                        "device_id": device_id,
-                        "hint": "Add GTWAY(cap_id) before IOR/IOW. Example: [80, 1, 71, 1, 82]"
-                    }
-
-    bytecode = encode_varint(m_tokens)
+    for device_id in io_devices:
+        if device_id not in gtway_caps:
+            return {
+                "error": f"IO operation on device {device_id} requires GTWAY capability",
+                "code": "UNAUTHORIZED_IO",
+                "device_id": device_id,
+                "hint": "Add GTWAY(cap_id) before IOR/IOW. Example: [80, 1, 71, 1, 82]"
+            }
+
+    # 全部 <0x80 时 varint 编码就是原字节
+    bytecode = code if code.isascii() else b"".join(map(_TOKEN_VARINT.__getitem__, code))
     return _serial_send(bytecode, timeout_ms)
 
 
+async def execute_m_logic_async(m_tokens: List[Any], timeout_ms: int = 5000) -> Dict[str, Any]:
+    """
+    execute_m_logic 的异步版本：串口往返放到工作线程，等待硬件期间不阻塞事件循环。
+
+    并发调用由 _serial_lock 串行化到同一条串口连接上。
+    """
+    return await asyncio.to_thread(execute_m_logic, m_tokens, timeout_ms)
+
+
 # =============================================================================
 # VM 状态
 # =============================================================================
 
+@functools.lru_cache(maxsize=32)
+def _empty_stack(depth: int) -> Tuple[int, ...]:
+    """按深度缓存的全零栈（不可变，可在多次调用间共享）。"""
+    return (0,) * depth
+
+
 def read_vm_state(stack_depth: int = 8) -> Dict[str, Any]:
     """
     Read VM runtime state.
@@ -326,7 +531,7 @@ def read_vm_state(stack_depth: int = 8) -> Dict[str, Any]:
         "fault_code": 0,
         "steps": 0,
         "sp": 0,
-        "stack": [0] * max(1, int(stack_depth)),
+        "stack": _empty_stack(max(1, int(stack_depth))),
         "result": 0,
         "note": "VM state read not yet implemented in firmware"
     }
@@ -336,10 +541,27 @@ def read_vm_state(stack_depth: int = 8) -> Dict[str, Any]:
 # 串口检测
 # =============================================================================
 
-def detect_serial_ports() -> Dict[str, Any]:
+# ESP8266 设备识别关键词
+_ESP8266_KEYWORDS = [
+    "usb", "usb serial", "uart",
+    "ch340", "ch341",  # 常见 USB-UART 芯片
+    "cp210", "cp2102", "cp210x",  # Silicon Labs
+    "ftdi", "ft232",  # FTDI
+    "pl2303",  # Prolific
+    "arduino", "nodemcu", "esp8266",
+    "serial port", "com port"
+]
+# 关键词合并成一条正则，每个字段只做一次 C 层扫描
+_ESP8266_PORT_RE = re.compile("|".join(re.escape(k) for k in _ESP8266_KEYWORDS), re.IGNORECASE)
+
+
+def detect_serial_ports(ports: Optional[List[Any]] = None) -> Dict[str, Any]:
     """
     自动检测系统可用串口，识别可能的 ESP8266 设备。
 
+    参数:
+        ports: 可选，调用方已枚举好的 comports() 结果（如带缓存的列表）；缺省时现场枚举
+
     返回:
         status: "detected" | "none_found" | "error"
         all_ports: 所有可用串口列表
@@ -348,16 +570,15 @@ def detect_serial_ports() -> Dict[str, Any]:
         hint: 使用提示
         error: 错误信息（如果有）
     """
-    try:
-        import serial.tools.list_ports
-    except ImportError:
+    if _list_ports is None:
         return {
             "status": "error",
             "error": "pyserial not installed",
             "solution": "Run: pip install pyserial"
         }
 
-    ports = serial.tools.list_ports.comports()
+    if ports is None:
+        ports = _list_ports.comports()
 
     if not ports:
         return {
@@ -384,34 +605,20 @@ def detect_serial_ports() -> Dict[str, Any]:
         }
         all_ports.append(port_info)
 
-    # ESP8266 设备识别关键词
-    esp8266_keywords = [
-        "usb", "usb serial", "uart",
-        "ch340", "ch341",  # 常见 USB-UART 芯片
-        "cp210", "cp2102", "cp210x",  # Silicon Labs
-        "ftdi", "ft232",  # FTDI
-        "pl2303",  # Prolific
-        "arduino", "nodemcu", "esp8266",
-        "serial port", "com port"
-    ]
-
-    # 识别可能是 ESP8266 的串口
+    # 识别可能是 ESP8266 的串口。
+    # 按列取出用于过滤的字段，每个串口只拼一次小写文本，只做一次正则扫描；
+    # 字段间用换行分隔，关键词不含换行，不会跨字段误匹配。
+    descs = [(p.description or "").lower() for p in ports]
+    manufs = [(p.manufacturer or "").lower() for p in ports]
+    hwids = [(p.hwid or "").lower() for p in ports]
     esp8266_candidates = []
-    for port in all_ports:
-        desc_lower = (port.get("description") or "").lower()
-        manuf_lower = (port.get("manufacturer") or "").lower()
-        hwid_lower = (port.get("hwid") or "").lower()
-
-        is_candidate = any(
-            keyword in desc_lower or keyword in manuf_lower or keyword in hwid_lower
-            for keyword in esp8266_keywords
-        )
-
-        # 过滤掉非串口设备（如蓝牙串口）
-        if is_candidate:
-            # 排除纯蓝牙串口
-            if "bluetooth" not in desc_lower and "bluetooth" not in manuf_lower:
-                esp8266_candidates.append(port)
+    for idx, (desc, manuf, hwid) in enumerate(zip(descs, manufs, hwids)):
+        named = f"{desc}\n{manuf}"
+        if not _ESP8266_PORT_RE.search(f"{named}\n{hwid}"):
+            continue
+        # 过滤掉非串口设备（排除纯蓝牙串口）
+        if "bluetooth" not in named:
+            esp8266_candidates.append(all_ports[idx])
 
     # 建议使用的串口：优先选择 ESP8266 候选串口，否则选择第一个
     if esp8266_candidates:
@@ -2,16 +2,34 @@
 # FastMCP 工具定义层 - 只负责暴露接口，不含业务逻辑
 
 import asyncio
+import atexit
+import functools
+import itertools
 import json
 import os
+import random
+import re
 import statistics
 import sys
 import time
 import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from threading import Lock
-from typing import Dict, Any, List
+from threading import Event, Lock, Thread
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
+try:
+    import serial.tools.list_ports as _list_ports  # type: ignore
+except Exception:
+    _list_ports = None
 
 from mcp.server.fastmcp import FastMCP
 from mcp.server.transport_security import TransportSecuritySettings
@@ -19,6 +37,7 @@ from skills import SkillEngine
 from core import (
     get_hardware_topology,
     execute_m_logic,
+    execute_m_logic_async,
     read_vm_state,
     detect_serial_ports
 )
@@ -32,20 +51,107 @@ _circuit_cooldown_sec = int(os.getenv("MCP_CIRCUIT_COOLDOWN_SEC", "15"))
 _read_retry_count = int(os.getenv("MCP_READ_RETRY_COUNT", "1"))
 _write_retry_count = int(os.getenv("MCP_WRITE_RETRY_COUNT", "0"))
 _serial_recover_attempts = int(os.getenv("MCP_SERIAL_RECOVER_ATTEMPTS", "2"))
+# 串口配置在导入时读取一次；进程内改动统一走 _set_serial_port（同时写回环境变量供 core 使用）
+_serial_port_env = os.getenv("MCP_SERIAL_PORT", "").strip()
+_BAUD = os.getenv("MCP_BAUD", "115200")
+_IS_WINDOWS = os.name == "nt"
+# Windows 串口名大小写不敏感（com3 == COM3），比较前统一成大写
+_COM_RE = re.compile(r"^COM\d{1,3}$", re.IGNORECASE)
+_RETRY_BASE_DELAY_MS = 50
+_RETRY_JITTER = 0.5
+# 入参校验类错误重试也不会变，直接失败
+_NON_RETRYABLE_CODES = frozenset(("INVALID_INPUT", "INVALID_TYPE", "TOKEN_RANGE", "BAD_OPCODE", "UNAUTHORIZED_IO"))
+_SERIAL_FAILURE_CODES = frozenset(("CONFIG_MISSING", "PORT_ERROR", "TIMEOUT_LEN", "TIMEOUT_RESP", "SERIAL_UNAVAILABLE"))
+# 工具参数 / 审计状态的成员判断常量
+_SAFETY_ACTION_MODES = frozenset(("none", "all_off", "pulse_relay"))
+_FAULT_MODES = frozenset(("off", "port_drop", "timeout_read", "timeout_write"))
+_EXPERIMENT_CASES = frozenset(("relay_closed_loop", "relay_baseline"))
+_FAIL_STATUSES = frozenset(("failed", "error", "blocked"))
+_ALERT_LEVELS = frozenset(("WARN", "CRITICAL"))
 _audit_dir = Path(os.getenv("MCP_AUDIT_DIR", "data/mcp"))
 _audit_file = _audit_dir / "audit.jsonl"
+_AUDIT_ON = os.getenv("MCP_AUDIT_ENABLED", "1") == "1"
+_AUDIT_FLUSH_EVERY = 64  # 攒够这么多条立即唤醒写线程
+_AUDIT_FLUSH_INTERVAL_SEC = 0.1  # 否则最多等这么久落盘
+_AUDIT_BUFFER_BYTES = 64 * 1024  # 文件写缓冲，单批超过即由 io 层直接下发
+_AUDIT_FSYNC_INTERVAL_SEC = 1.0  # fsync 节流：最多每秒一次，退出时强制一次
+_AUDIT_QUEUE_MAX = 10000  # 磁盘卡住时队列上限，超出的事件只计数
 _experiment_dir = Path(os.getenv("MCP_EXPERIMENT_DIR", "data/mcp/experiments"))
 
+# 参数校验 / 缺串口的错误响应模板，按 {**TMPL, "error": ...} 展开
+_BAD_ARG_TMPL = {"status": "error", "code": "BAD_ARG"}
+_PORT_MISSING_TMPL = {"status": "error", "code": "PORT_MISSING"}
+
+_STATUS_SUCCESS = {"status": "success"}
+
 _WATER_DEVICE_ID = 1
 _TEMP_DEVICE_ID = 2
 _HUMIDITY_DEVICE_ID = 3
 _RELAY1_DEVICE_ID = 5
 _RELAY2_DEVICE_ID = 6
+# 拓扑由固件约定决定，导入时取一次（共享只读，调用方不得修改）
+_HW_TOPOLOGY_CACHE = get_hardware_topology()
+_ENV_DEVICE_IDS = (_WATER_DEVICE_ID, _TEMP_DEVICE_ID, _HUMIDITY_DEVICE_ID)
+# 已知设备的 IOR 程序在导入时建好，读路径不再每次分配列表
+_READ_TOKENS: Dict[int, Tuple[int, ...]] = {
+    d: (80, d, 71, d, 82)
+    for d in (_WATER_DEVICE_ID, _TEMP_DEVICE_ID, _HUMIDITY_DEVICE_ID, _RELAY1_DEVICE_ID, _RELAY2_DEVICE_ID)
+}
+
+_CIRCUIT_ARMED = 0
+_CIRCUIT_TRIPPED = 1
+_CIRCUIT_STATE_NAMES = ("ARMED", "TRIPPED")
+_CIRCUIT_CLEAN: Tuple[int, int, float] = (_CIRCUIT_ARMED, 0, 0.0)
+
+
+@dataclass
+class _CircuitEntry:
+    """单个熔断 key 的状态。
+
+    state 是 (状态, 失败次数, 冷却截止) 的不可变元组，状态迁移时整体替换；
+    读者无锁取一次引用即可拿到一致快照，只有迁移持有 key 所在分段的锁。
+    """
+    state: Tuple[int, int, float] = _CIRCUIT_CLEAN
+
 
-_circuit_lock = Lock()
 _audit_lock = Lock()
 _fault_lock = Lock()
-_circuit_state: Dict[str, Dict[str, Any]] = {}
+_port_cache_lock = Lock()
+_port_cache: Optional[str] = None  # 上次确认可用的串口，显式失效前不再枚举
+_SERIAL_CFG_TTL_SEC = 2.0
+_PORT_LIST_TTL_SEC = 2.0
+_port_list_lock = Lock()
+_port_list_cache: Tuple[float, List[Any]] = (float("-inf"), [])  # (时间, comports 结果)
+_serial_cfg_cache: Optional[Tuple[Tuple[str, str], float, Dict[str, Any]]] = None  # ((port, baud), 时间, 结果)
+_circuit_writer_lock = Lock()
+_CIRCUIT_STRIPES = 16  # 2 的幂，按 key 哈希取模分段加锁
+_circuit_stripes = tuple(Lock() for _ in range(_CIRCUIT_STRIPES))
+# 写时复制：新增 key 时整体替换字典，读者无锁拿到的快照永不被原地修改
+_circuit_state: Dict[str, _CircuitEntry] = {}
+# 审计记录先入队，由后台写线程批量追加到常开的 audit.jsonl
+# 不设 maxlen：满队时由 _audit_event 显式计数丢弃，避免 deque 静默挤掉旧记录
+_audit_queue: deque = deque()
+_audit_drop_lock = Lock()
+# 最近审计事件的内存窗口，get_recent_audit_events_mcp 优先从这里取，不碰磁盘
+_recent_events: deque = deque(maxlen=1024)
+_recent_lock = Lock()
+# 失败事件在写入时就挑出来，元素为 (序号, 事件)；序号用于按“最近 N 条”窗口过滤
+_recent_fail_events: deque = deque(maxlen=256)
+_audit_seq = 0
+_audit_dropped = 0
+_audit_wakeup = Event()
+_audit_fh = None
+_audit_last_fsync = 0.0
+# 环境快照的三路传感器读取并发提交（串口往返本身由 core 串行化）
+_io_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="mcp-io")
+# 自检时拓扑读取与串口探测并行；与 _io_pool 分开，避免嵌套提交互相占满
+_check_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mcp-check")
+# 健康报告的设备自检放到工作线程里，以便超时返回；同一时刻至多一次自检在跑，
+# 超时后仍未结束的自检由后续报告复用等待，不会在池里越排越长
+_health_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mcp-health")
+_health_check_lock = Lock()
+_health_check_fut: Future | None = None
+_HEALTH_SELF_CHECK_TIMEOUT_SEC = 30.0
 _fault_injection: Dict[str, Any] = {
     "mode": "off",
     "every_n": 0,
@@ -63,48 +169,93 @@ app = FastMCP(
 )
 
 
-def _ensure_serial_port() -> str:
-    """Ensure serial port is configured, try auto-detection if missing."""
-    import serial.tools.list_ports
-
-    port = os.getenv("MCP_SERIAL_PORT", "").strip()
-    if port:
-        # Validate configured port first; if stale, fall back to auto-detect.
+def _list_ports_cached() -> List[Any]:
+    """comports() 结果缓存 _PORT_LIST_TTL_SEC 秒，突发调用不重复枚举 USB/注册表。"""
+    global _port_list_cache
+    if _list_ports is None:
+        return []
+    ts, ports = _port_list_cache
+    now = time.monotonic()
+    if now - ts < _PORT_LIST_TTL_SEC:
+        return ports
+    with _port_list_lock:
+        ts, ports = _port_list_cache
+        if now - ts < _PORT_LIST_TTL_SEC:
+            return ports
         try:
-            ports = list(serial.tools.list_ports.comports())
+            ports = list(_list_ports.comports())
         except Exception:
             ports = []
-        devices = {p.device for p in ports}
-        if port in devices:
-            os.environ["MCP_SERIAL_PORT"] = port
-            return port
+        _port_list_cache = (time.monotonic(), ports)
+        return ports
 
-    try:
-        ports = list(serial.tools.list_ports.comports())
-    except Exception:
-        ports = []
-
-    if not ports:
-        return ""
 
-    port = ports[0].device
+def _set_serial_port(port: str) -> None:
+    global _serial_port_env
+    _serial_port_env = port
     os.environ["MCP_SERIAL_PORT"] = port
-    return port
+
+
+def _refresh_serial_env() -> None:
+    """外部修改了 MCP_SERIAL_PORT / MCP_BAUD 后调用，重新读取环境变量。"""
+    global _serial_port_env, _BAUD
+    _serial_port_env = os.getenv("MCP_SERIAL_PORT", "").strip()
+    _BAUD = os.getenv("MCP_BAUD", "115200")
+
+
+def _invalidate_port_cache() -> None:
+    global _port_cache
+    with _port_cache_lock:
+        _port_cache = None
+
+
+def _ensure_serial_port() -> str:
+    """Ensure serial port is configured, try auto-detection if missing."""
+    global _port_cache
+    port = _serial_port_env
+    cached = _port_cache
+    if cached is not None and (not port or port == cached):
+        if port != cached:
+            _set_serial_port(cached)
+        return cached
+
+    with _port_cache_lock:
+        port = _serial_port_env
+        if _port_cache is not None and (not port or port == _port_cache):
+            _set_serial_port(_port_cache)
+            return _port_cache
+
+        ports = _list_ports_cached()
+        if port:
+            # Validate configured port first; if stale, fall back to auto-detect.
+            if port in {p.device for p in ports}:
+                _set_serial_port(port)
+                _port_cache = port
+                return port
+
+        if not ports:
+            return ""
+
+        port = ports[0].device
+        _set_serial_port(port)
+        _port_cache = port
+        return port
 
 
 def _is_serial_failure(result: Dict[str, Any]) -> bool:
     code = str(result.get("code", "")).strip().upper()
-    return code in {
-        "CONFIG_MISSING",
-        "PORT_ERROR",
-        "TIMEOUT_LEN",
-        "TIMEOUT_RESP",
-        "SERIAL_UNAVAILABLE",
-    }
+    return code in _SERIAL_FAILURE_CODES
+
+
+def _is_retryable(result: Dict[str, Any]) -> bool:
+    """串口/超时类失败可重试；入参校验错误与 VM 执行故障（带 pc）是确定性的。"""
+    if result.get("code") in _NON_RETRYABLE_CODES:
+        return False
+    return "pc" not in result
 
 
 def _recover_serial_port() -> Dict[str, Any]:
-    previous = os.getenv("MCP_SERIAL_PORT", "").strip()
+    previous = _serial_port_env
     detected = detect_serial_ports()
     if detected.get("status") != "detected":
         return {"recovered": False, "previous_port": previous, "reason": "no_ports"}
@@ -114,11 +265,9 @@ def _recover_serial_port() -> Dict[str, Any]:
     if not new_port:
         return {"recovered": False, "previous_port": previous, "reason": "no_suggested_port"}
 
-    os.environ["MCP_SERIAL_PORT"] = new_port
-    with _circuit_lock:
-        for st in _circuit_state.values():
-            st["failures"] = 0
-            st["open_until"] = 0.0
+    _set_serial_port(new_port)
+    _invalidate_port_cache()
+    _reset_circuits()
     payload = {
         "recovered": True,
         "previous_port": previous,
@@ -129,49 +278,180 @@ def _recover_serial_port() -> Dict[str, Any]:
     return payload
 
 
+_ts_cache = (0, "")  # (毫秒时间戳, ISO 字符串)
+
+
 def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+    """UTC ISO 时间（毫秒精度）；同一毫秒内的审计事件复用已格式化的字符串。"""
+    global _ts_cache
+    ms = int(time.time() * 1000)
+    cached = _ts_cache
+    if ms == cached[0]:
+        return cached[1]
+    text = datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat()
+    _ts_cache = (ms, text)
+    return text
+
+
+# 审计行按 bytes 直接解析：orjson 可用时走 C 实现
+_json_loads = orjson.loads if orjson is not None else json.loads
+_ORJSON_AUDIT_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE if orjson is not None else 0
+
+
+def _dumps_audit(rec: Dict[str, Any]) -> bytes:
+    """序列化一条审计记录为一行 UTF-8 JSONL（含换行）；orjson 可用时走 C 实现，不支持的值回退标准库。"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(rec, option=_ORJSON_AUDIT_OPTS)
+        except TypeError:
+            pass
+    return json.dumps(rec, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8") + b"\n"
 
 
 def _audit_event(event_type: str, payload: Dict[str, Any]) -> None:
-    """Append one structured audit event as JSONL."""
-    try:
-        _audit_dir.mkdir(parents=True, exist_ok=True)
-        rec = {
-            "ts": _now_iso(),
-            "event_type": event_type,
-            **payload,
-        }
-        line = json.dumps(rec, ensure_ascii=False)
-        with _audit_lock:
-            with _audit_file.open("a", encoding="utf-8") as f:
-                f.write(line + "\n")
-    except Exception:
-        # Audit failure must not break tool execution.
-        pass
+    """Queue one structured audit event; the writer thread appends it as JSONL."""
+    global _audit_dropped, _audit_seq
+    if not _AUDIT_ON:
+        return
+    rec = {
+        "ts": _now_iso(),
+        "event_type": event_type,
+        **payload,
+    }
+    with _recent_lock:
+        _recent_events.append(rec)
+        _audit_seq += 1
+        if rec.get("status") in _FAIL_STATUSES:
+            _recent_fail_events.append((_audit_seq, rec))
+    # 判满与入队在同一把锁内完成，队列才不会越过上限；超限的记录计入 dropped
+    with _audit_drop_lock:
+        queued = len(_audit_queue)
+        if queued >= _AUDIT_QUEUE_MAX:
+            _audit_dropped += 1
+        else:
+            _audit_queue.append(rec)
+            queued += 1
+    if queued >= _AUDIT_FLUSH_EVERY:
+        _audit_wakeup.set()
+
+
+def _flush_audit(sync: bool = False) -> None:
+    """把队列中的审计记录一次性写入文件（写线程、读审计前与进程退出时调用）。
+
+    sync=True 时无论节流间隔都执行一次 fsync。
+    """
+    global _audit_fh, _audit_dropped, _audit_last_fsync
+    fsync_fd = None
+    with _audit_lock:
+        batch: List[Dict[str, Any]] = []
+        try:
+            while True:
+                batch.append(_audit_queue.popleft())
+        except IndexError:
+            pass
+        with _audit_drop_lock:
+            dropped, _audit_dropped = _audit_dropped, 0
+        if dropped:
+            batch.append({"ts": _now_iso(), "event_type": "audit_dropped", "count": dropped})
+        if not batch and not (sync and _audit_fh is not None):
+            return
+        # 逐条序列化：单条记录无法编码时只丢这一条，不连累同批的其它记录
+        lines: List[bytes] = []
+        for rec in batch:
+            try:
+                lines.append(_dumps_audit(rec))
+            except Exception:
+                pass
+        try:
+            if _audit_fh is None:
+                _audit_dir.mkdir(parents=True, exist_ok=True)
+                _audit_fh = _audit_file.open("ab", buffering=_AUDIT_BUFFER_BYTES)
+            _audit_fh.writelines(lines)
+            _audit_fh.flush()
+            now = time.monotonic()
+            if sync or now - _audit_last_fsync >= _AUDIT_FSYNC_INTERVAL_SEC:
+                fsync_fd = _audit_fh.fileno()
+                _audit_last_fsync = now
+        except Exception:
+            # Audit failure must not break tool execution.
+            pass
+    # fsync 放在锁外：落盘可能耗时数十毫秒，不应挡住读审计前的 flush；文件常开不关，fd 始终有效
+    if fsync_fd is not None:
+        try:
+            os.fsync(fsync_fd)
+        except OSError:
+            pass
+
+
+def _audit_writer() -> None:
+    while True:
+        _audit_wakeup.wait(_AUDIT_FLUSH_INTERVAL_SEC)
+        _audit_wakeup.clear()
+        _flush_audit()
+
+
+if _AUDIT_ON:
+    Thread(target=_audit_writer, name="mcp-audit-writer", daemon=True).start()
+    atexit.register(_flush_audit, True)
+
+
+# tool_call 审计从响应中摘取的字段；值为 None 的字段不落盘
+_AUDIT_RESPONSE_FIELDS = (
+    "status",
+    "completed",
+    "code",
+    "fault",
+    "fault_code",
+    "port_used",
+    "requested_state",
+    "actual_state",
+    "matched",
+    "action_applied",
+    "retry_count",
+    "fallback_action",
+    "latency_ms",
+)
 
 
 def _audit_tool_call(tool: str, request: Dict[str, Any], response: Dict[str, Any]) -> None:
-    _audit_event(
-        "tool_call",
-        {
-            "tool": tool,
-            "request": request,
-            "status": response.get("status"),
-            "completed": response.get("completed"),
-            "code": response.get("code"),
-            "fault": response.get("fault"),
-            "fault_code": response.get("fault_code"),
-            "port_used": response.get("port_used"),
-            "requested_state": response.get("requested_state"),
-            "actual_state": response.get("actual_state"),
-            "matched": response.get("matched"),
-            "action_applied": response.get("action_applied"),
-            "retry_count": response.get("retry_count"),
-            "fallback_action": response.get("fallback_action"),
-            "latency_ms": response.get("latency_ms"),
-        },
-    )
+    if not _AUDIT_ON:
+        return
+    payload: Dict[str, Any] = {"tool": tool, "request": request}
+    for key in _AUDIT_RESPONSE_FIELDS:
+        value = response.get(key)
+        if value is not None:
+            payload[key] = value
+    _audit_event("tool_call", payload)
+
+
+def _make_auditor(tool: str, arg_keys: Tuple[str, ...]):
+    """为固定工具名与参数键生成专用审计函数：audit(args, response)。
+
+    args 按 arg_keys 顺序给出；审计关闭时直接返回空函数。
+    """
+    if not _AUDIT_ON:
+        return lambda args, response: None
+    fields = _AUDIT_RESPONSE_FIELDS
+    event = _audit_event
+
+    def audit(args: Tuple[Any, ...], response: Dict[str, Any]) -> None:
+        payload: Dict[str, Any] = {"tool": tool, "request": dict(zip(arg_keys, args))}
+        get = response.get
+        for key in fields:
+            value = get(key)
+            if value is not None:
+                payload[key] = value
+        event("tool_call", payload)
+
+    return audit
+
+
+# 调用最频繁的两个工具使用专用审计函数
+_audit_snapshot = _make_auditor("read_environment_snapshot_mcp", ("samples", "sample_interval_ms", "timeout_ms"))
+_audit_relay_set = _make_auditor("relay_set_mcp", ("channel", "state", "duration_sec"))
+_audit_relay_set_verified = _make_auditor(
+    "relay_set_mcp", ("channel", "state", "duration_sec", "verify", "verify_retries")
+)
 
 
 def _current_fault_mode() -> str:
@@ -198,7 +478,7 @@ def _inject_fault_if_needed(op: str) -> Dict[str, Any] | None:
         return None
 
     if mode == "port_drop":
-        os.environ["MCP_SERIAL_PORT"] = ""
+        _set_serial_port("")
         return {
             "completed": False,
             "code": "SERIAL_UNAVAILABLE",
@@ -225,20 +505,59 @@ def _inject_fault_if_needed(op: str) -> Dict[str, Any] | None:
     return None
 
 
+@functools.lru_cache(maxsize=64)
 def _circuit_key(op: str, device_id: int) -> str:
     return f"{op}:{device_id}"
 
 
+def _lock_for(key: str) -> Lock:
+    return _circuit_stripes[hash(key) & (_CIRCUIT_STRIPES - 1)]
+
+
+def _circuit_entry(key: str) -> _CircuitEntry:
+    global _circuit_state
+    st = _circuit_state.get(key)
+    if st is None:
+        with _circuit_writer_lock:
+            st = _circuit_state.get(key)
+            if st is None:
+                st = _CircuitEntry()
+                _circuit_state = {**_circuit_state, key: st}
+    return st
+
+
+def _reset_circuits(target: str = "all") -> List[str]:
+    """清零熔断计数与冷却；target 为 all 或具体 key，返回被清理的 key。"""
+    if target == "all":
+        # 逐条原地清零：并发失败路径可能已拿到条目引用，换新对象会让它的更新写丢
+        entries = _circuit_state
+        for key, st in entries.items():
+            with _lock_for(key):
+                st.state = _CIRCUIT_CLEAN
+        return list(entries)
+    st = _circuit_state.get(target)
+    if st is None:
+        return []
+    with _lock_for(target):
+        st.state = _CIRCUIT_CLEAN
+    return [target]
+
+
 def _circuit_check(op: str, device_id: int) -> Dict[str, Any] | None:
     key = _circuit_key(op, device_id)
+    st = _circuit_entry(key)
     now = time.time()
-    with _circuit_lock:
-        st = _circuit_state.setdefault(key, {"failures": 0, "open_until": 0.0})
-        open_until = float(st.get("open_until", 0.0))
-        if open_until <= now:
-            st["open_until"] = 0.0
-            return None
-        retry_after = max(1, int(round(open_until - now)))
+    state, _, open_until = st.state
+    if state == _CIRCUIT_ARMED:
+        return None
+    if open_until <= now:
+        # 冷却结束：TRIPPED -> ARMED，加锁后复核，避免覆盖并发的新一轮熔断
+        with _lock_for(key):
+            cur = st.state
+            if cur[0] == _CIRCUIT_TRIPPED and cur[2] <= now:
+                st.state = _CIRCUIT_CLEAN
+        return None
+    retry_after = max(1, int(round(open_until - now)))
     return {
         "completed": False,
         "status": "failed",
@@ -252,23 +571,27 @@ def _circuit_check(op: str, device_id: int) -> Dict[str, Any] | None:
 
 def _circuit_on_success(op: str, device_id: int) -> None:
     key = _circuit_key(op, device_id)
-    with _circuit_lock:
-        st = _circuit_state.setdefault(key, {"failures": 0, "open_until": 0.0})
-        st["failures"] = 0
-        st["open_until"] = 0.0
+    st = _circuit_entry(key)
+    # 稳态下已是 ARMED 且无失败计数，无锁读一次即可返回
+    if st.state == _CIRCUIT_CLEAN:
+        return
+    with _lock_for(key):
+        st.state = _CIRCUIT_CLEAN
 
 
 def _circuit_on_failure(op: str, device_id: int, reason: str) -> None:
     key = _circuit_key(op, device_id)
+    st = _circuit_entry(key)
     now = time.time()
     opened = False
-    with _circuit_lock:
-        st = _circuit_state.setdefault(key, {"failures": 0, "open_until": 0.0})
-        st["failures"] = int(st.get("failures", 0)) + 1
-        if st["failures"] >= _circuit_fail_threshold:
-            st["open_until"] = now + _circuit_cooldown_sec
-            st["failures"] = 0
+    with _lock_for(key):
+        state, failures, open_until = st.state
+        failures += 1
+        if failures >= _circuit_fail_threshold:
+            st.state = (_CIRCUIT_TRIPPED, 0, now + _circuit_cooldown_sec)
             opened = True
+        else:
+            st.state = (state, failures, open_until)
     if opened:
         _audit_event(
             "circuit_opened",
@@ -283,7 +606,7 @@ def _circuit_on_failure(op: str, device_id: int, reason: str) -> None:
 def _execute_with_guard(
     op: str,
     device_id: int,
-    m_tokens: List[int],
+    m_tokens: Tuple[int, ...],
     timeout_ms: int,
     retry_count: int,
 ) -> Dict[str, Any]:
@@ -294,6 +617,7 @@ def _execute_with_guard(
     last: Dict[str, Any] = {}
     max_attempts = max(1, retry_count + 1)
     recoveries = 0
+    started = time.monotonic()
     for attempt in range(1, max_attempts + 1):
         injected = _inject_fault_if_needed(op)
         last = injected if injected is not None else execute_m_logic(m_tokens, timeout_ms=timeout_ms)
@@ -301,11 +625,20 @@ def _execute_with_guard(
         if last.get("completed"):
             _circuit_on_success(op, device_id)
             return last
+        if not _is_retryable(last):
+            break
         if _is_serial_failure(last) and recoveries < max(0, _serial_recover_attempts):
             recoveries += 1
             last["recovery"] = _recover_serial_port()
             if last["recovery"].get("recovered"):
                 continue
+        if attempt < max_attempts:
+            # 指数退避 + 抖动，总等待不超过 timeout_ms 剩余预算
+            remaining_ms = timeout_ms - (time.monotonic() - started) * 1000
+            delay_ms = _RETRY_BASE_DELAY_MS * (1 << (attempt - 1)) * (1 + random.random() * _RETRY_JITTER)
+            delay_ms = min(remaining_ms, delay_ms)
+            if delay_ms > 0:
+                time.sleep(delay_ms / 1000.0)
 
     reason = str(last.get("fault") or last.get("error") or "unknown")
     _circuit_on_failure(op, device_id, reason=reason)
@@ -315,7 +648,7 @@ def _execute_with_guard(
 
 def _read_device(device_id: int, timeout_ms: int = 5000) -> Dict[str, Any]:
     """Read one device value through M-Token IOR."""
-    m_tokens = [80, device_id, 71, device_id, 82]
+    m_tokens = _READ_TOKENS.get(device_id) or (80, device_id, 71, device_id, 82)
     return _execute_with_guard(
         op="read",
         device_id=device_id,
@@ -325,9 +658,78 @@ def _read_device(device_id: int, timeout_ms: int = 5000) -> Dict[str, Any]:
     )
 
 
+# 合并读：每个读数加偏置 127 后占 12 bit，按顺序拼进 HALT 返回的一个整数。
+# 操作数 token 按固件 LIT 的 zigzag 解码：128 → 64，254 → 127。
+_BATCH_FIELD_BITS = 12
+_BATCH_FIELD_BIAS = 127
+_BATCH_SHIFT_TOKENS = (30, 128, 64, 52, 52)  # LIT 64, DUP, MUL, MUL：栈顶 ×4096
+_BATCH_BIAS_TOKENS = (30, 254, 50)  # LIT 127, ADD
+# 只有这些 VM 故障说明固件跑不了合并读程序；STEP_LIMIT 等偶发故障不关闭合并读
+_BATCH_UNSUPPORTED_FAULTS = frozenset(("UNKNOWN_OP", "BAD_ENCODING"))
+_batch_read_supported = True
+
+
+def _read_devices_batch(device_ids: Tuple[int, ...], timeout_ms: int = 5000) -> List[Dict[str, Any]] | None:
+    """Read several devices in one M-Token program; None means use per-device reads.
+
+    串口失败时直接返回逐设备的失败结果（并计入各自熔断），不再回退逐个读。
+    """
+    global _batch_read_supported
+    if not _batch_read_supported or _current_fault_mode() != "off":
+        return None
+    for device_id in device_ids:
+        if _circuit_check("read", device_id) is not None:
+            return None
+
+    m_tokens: List[int] = []
+    for device_id in device_ids:
+        m_tokens += (80, device_id)
+    for i, device_id in enumerate(device_ids):
+        if i:
+            m_tokens += _BATCH_SHIFT_TOKENS
+        m_tokens += (71, device_id, *_BATCH_BIAS_TOKENS)
+        if i:
+            m_tokens.append(50)  # ADD
+    m_tokens.append(82)
+
+    raw = execute_m_logic(m_tokens, timeout_ms=timeout_ms)
+    if not raw.get("completed"):
+        if _is_serial_failure(raw):
+            # 串口已失败，逐设备重读只会把超时预算再花一遍
+            reason = str(raw.get("error") or raw.get("code") or "unknown")
+            out = []
+            for device_id in device_ids:
+                _circuit_on_failure("read", device_id, reason=reason)
+                out.append({**raw, "attempt": 1, "batched": True})
+            return out
+        if raw.get("fault") in _BATCH_UNSUPPORTED_FAULTS:
+            # 固件不支持该组合程序，之后不再尝试
+            _batch_read_supported = False
+        return None
+
+    packed = int(raw.get("result", 0))
+    mask = (1 << _BATCH_FIELD_BITS) - 1
+    values: List[int] = []
+    for _ in device_ids:
+        values.append((packed & mask) - _BATCH_FIELD_BIAS)
+        packed >>= _BATCH_FIELD_BITS
+    values.reverse()
+
+    out: List[Dict[str, Any]] = []
+    for device_id, value in zip(device_ids, values):
+        _circuit_on_success("read", device_id)
+        out.append({"completed": True, "result": value, "steps": raw.get("steps"), "attempt": 1, "batched": True})
+    return out
+
+
+@functools.lru_cache(maxsize=32)
+def _write_tokens(device_id: int, value: int) -> Tuple[int, ...]:
+    return (80, device_id, 30, value, 70, device_id, 82)
+
+
 def _write_device(device_id: int, value: int, timeout_ms: int = 5000) -> Dict[str, Any]:
     """Write one device value through M-Token IOW."""
-    m_tokens = [80, device_id, 30, value, 70, device_id, 82]
+    m_tokens = _write_tokens(device_id, value)
     return _execute_with_guard(
         op="write",
         device_id=device_id,
@@ -405,25 +807,30 @@ def _read_relay_channels(timeout_ms: int = 5000) -> Dict[str, Any]:
 
 
 def _decorate_result(raw: Dict[str, Any], port: str, op: str, device_id: int) -> Dict[str, Any]:
-    """Attach common metadata for MCP tool responses."""
-    out = dict(raw)
-    out["op"] = op
-    out["device_id"] = device_id
-    out["port_used"] = port
-    out["status"] = "success" if out.get("completed") else "failed"
-    if not out.get("completed"):
-        out["hint"] = (
-            f"设备 {device_id} 在串口 {port} 执行失败，请检查连接、供电和固件。"
-        )
-    return out
+    """Attach common metadata for MCP tool responses (mutates and returns raw)."""
+    raw["op"] = op
+    raw["device_id"] = device_id
+    raw["port_used"] = port
+    if raw.get("completed"):
+        raw["status"] = "success"
+    else:
+        raw["status"] = "failed"
+        raw["hint"] = f"设备 {device_id} 在串口 {port} 执行失败，请检查连接、供电和固件。"
+    return raw
 
 
 def _quality_flag(values: List[int], tolerance: int) -> str:
     """Simple stability flag for sampled values."""
     if len(values) <= 1:
         return "unknown"
-    spread = max(values) - min(values)
-    return "stable" if spread <= tolerance else "noisy"
+    it = iter(values)
+    lo = hi = next(it)
+    for v in it:
+        if v < lo:
+            lo = v
+        elif v > hi:
+            hi = v
+    return "stable" if hi - lo <= tolerance else "noisy"
 
 
 @app.tool()
@@ -438,9 +845,8 @@ def get_hardware_topology_mcp() -> Dict[str, Any]:
     - 继电器2 (device_id=6, D2引脚, 写入 0=关闭, 1=开启)
 
     不需要调用此工具也能控制硬件，工具描述中已有设备 ID 列表。"""
-    out = get_hardware_topology()
-    _audit_tool_call("get_hardware_topology_mcp", {}, {"status": "success", **out})
-    return out
+    _audit_tool_call("get_hardware_topology_mcp", {}, _STATUS_SUCCESS)
+    return _HW_TOPOLOGY_CACHE
 
 
 @app.tool()
@@ -467,7 +873,7 @@ def read_temperature_mcp(timeout_ms: int = 5000) -> Dict[str, Any]:
     """读取温度传感器（device_id=2，单位摄氏度）。"""
     port = _ensure_serial_port()
     if not port:
-        out = {"status": "error", "error": "未检测到串口设备", "code": "PORT_MISSING"}
+        out = {**_PORT_MISSING_TMPL, "error": "未检测到串口设备"}
         _audit_tool_call("read_temperature_mcp", {"timeout_ms": timeout_ms}, out)
         return out
     raw = _read_device(_TEMP_DEVICE_ID, timeout_ms=timeout_ms)
@@ -484,7 +890,7 @@ def read_humidity_mcp(timeout_ms: int = 5000) -> Dict[str, Any]:
     """读取湿度传感器（device_id=3，单位百分比）。"""
     port = _ensure_serial_port()
     if not port:
-        out = {"status": "error", "error": "未检测到串口设备", "code": "PORT_MISSING"}
+        out = {**_PORT_MISSING_TMPL, "error": "未检测到串口设备"}
         _audit_tool_call("read_humidity_mcp", {"timeout_ms": timeout_ms}, out)
         return out
     raw = _read_device(_HUMIDITY_DEVICE_ID, timeout_ms=timeout_ms)
@@ -504,30 +910,18 @@ def read_environment_snapshot_mcp(
 ) -> Dict[str, Any]:
     """读取水位+温度+湿度快照，支持短窗口多次采样。"""
     if samples < 1 or samples > 10:
-        out = {"status": "error", "error": "samples 必须在 1~10 之间", "code": "BAD_ARG"}
-        _audit_tool_call(
-            "read_environment_snapshot_mcp",
-            {"samples": samples, "sample_interval_ms": sample_interval_ms, "timeout_ms": timeout_ms},
-            out,
-        )
+        out = {**_BAD_ARG_TMPL, "error": "samples 必须在 1~10 之间"}
+        _audit_snapshot((samples, sample_interval_ms, timeout_ms), out)
         return out
     if sample_interval_ms < 0 or sample_interval_ms > 5000:
-        out = {"status": "error", "error": "sample_interval_ms 必须在 0~5000 之间", "code": "BAD_ARG"}
-        _audit_tool_call(
-            "read_environment_snapshot_mcp",
-            {"samples": samples, "sample_interval_ms": sample_interval_ms, "timeout_ms": timeout_ms},
-            out,
-        )
+        out = {**_BAD_ARG_TMPL, "error": "sample_interval_ms 必须在 0~5000 之间"}
+        _audit_snapshot((samples, sample_interval_ms, timeout_ms), out)
         return out
 
     port = _ensure_serial_port()
     if not port:
-        out = {"status": "error", "error": "未检测到串口设备", "code": "PORT_MISSING"}
-        _audit_tool_call(
-            "read_environment_snapshot_mcp",
-            {"samples": samples, "sample_interval_ms": sample_interval_ms, "timeout_ms": timeout_ms},
-            out,
-        )
+        out = {**_PORT_MISSING_TMPL, "error": "未检测到串口设备"}
+        _audit_snapshot((samples, sample_interval_ms, timeout_ms), out)
         return out
 
     water_values: List[int] = []
@@ -535,10 +929,15 @@ def read_environment_snapshot_mcp(
     humidity_values: List[int] = []
     errors: List[Dict[str, Any]] = []
 
+    # 按目标时刻排程：第 i 个样本落在 t0 + i*interval，sleep 粒度误差不累积
+    t0 = time.perf_counter()
+    interval_sec = sample_interval_ms / 1000.0
     for i in range(samples):
-        water = _read_device(_WATER_DEVICE_ID, timeout_ms=timeout_ms)
-        temp = _read_device(_TEMP_DEVICE_ID, timeout_ms=timeout_ms)
-        humidity = _read_device(_HUMIDITY_DEVICE_ID, timeout_ms=timeout_ms)
+        batch = _read_devices_batch(_ENV_DEVICE_IDS, timeout_ms=timeout_ms)
+        if batch is None:
+            futures = [_io_pool.submit(_read_device, d, timeout_ms) for d in _ENV_DEVICE_IDS]
+            batch = [f.result() for f in futures]
+        water, temp, humidity = batch
 
         if water.get("completed"):
             water_values.append(int(water.get("result", 0)))
@@ -556,7 +955,9 @@ def read_environment_snapshot_mcp(
             errors.append({"sample": i + 1, "device_id": _HUMIDITY_DEVICE_ID, "fault": humidity.get("fault"), "sensor_valid": False})
 
         if i < samples - 1 and sample_interval_ms > 0:
-            time.sleep(sample_interval_ms / 1000.0)
+            remaining = t0 + (i + 1) * interval_sec - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
 
     def _avg(values: List[int]) -> float | None:
         if not values:
@@ -590,11 +991,7 @@ def read_environment_snapshot_mcp(
         **_read_relay_channels(timeout_ms=timeout_ms),
         "errors": errors,
     }
-    _audit_tool_call(
-        "read_environment_snapshot_mcp",
-        {"samples": samples, "sample_interval_ms": sample_interval_ms, "timeout_ms": timeout_ms},
-        out,
-    )
+    _audit_snapshot((samples, sample_interval_ms, timeout_ms), out)
     return out
 
 
@@ -605,13 +1002,13 @@ def read_relay_state_mcp(
 ) -> Dict[str, Any]:
     """读取继电器真实状态。channel=0 读全部，1/2 读单路。"""
     if channel not in (0, 1, 2):
-        out = {"status": "error", "error": "channel 仅支持 0/1/2", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "channel 仅支持 0/1/2"}
         _audit_tool_call("read_relay_state_mcp", {"channel": channel, "timeout_ms": timeout_ms}, out)
         return out
 
     port = _ensure_serial_port()
     if not port:
-        out = {"status": "error", "error": "未检测到串口设备", "code": "PORT_MISSING"}
+        out = {**_PORT_MISSING_TMPL, "error": "未检测到串口设备"}
         _audit_tool_call("read_relay_state_mcp", {"channel": channel, "timeout_ms": timeout_ms}, out)
         return out
 
@@ -643,16 +1040,16 @@ def relay_set_mcp(
 ) -> Dict[str, Any]:
     """控制单路继电器（channel=1/2, state=0/1）。支持自动回落关闭。"""
     if channel not in (1, 2):
-        out = {"status": "error", "error": "channel 仅支持 1 或 2", "code": "BAD_ARG"}
-        _audit_tool_call("relay_set_mcp", {"channel": channel, "state": state, "duration_sec": duration_sec}, out)
+        out = {**_BAD_ARG_TMPL, "error": "channel 仅支持 1 或 2"}
+        _audit_relay_set((channel, state, duration_sec), out)
         return out
     if state not in (0, 1):
-        out = {"status": "error", "error": "state 仅支持 0(关) 或 1(开)", "code": "BAD_ARG"}
-        _audit_tool_call("relay_set_mcp", {"channel": channel, "state": state, "duration_sec": duration_sec}, out)
+        out = {**_BAD_ARG_TMPL, "error": "state 仅支持 0(关) 或 1(开)"}
+        _audit_relay_set((channel, state, duration_sec), out)
         return out
     if duration_sec < 0:
-        out = {"status": "error", "error": "duration_sec 不能为负数", "code": "BAD_ARG"}
-        _audit_tool_call("relay_set_mcp", {"channel": channel, "state": state, "duration_sec": duration_sec}, out)
+        out = {**_BAD_ARG_TMPL, "error": "duration_sec 不能为负数"}
+        _audit_relay_set((channel, state, duration_sec), out)
         return out
     if duration_sec > _relay_max_duration_sec:
         out = {
@@ -660,7 +1057,7 @@ def relay_set_mcp(
             "error": f"duration_sec 超出上限 {_relay_max_duration_sec}s",
             "code": "SAFETY_LIMIT",
         }
-        _audit_tool_call("relay_set_mcp", {"channel": channel, "state": state, "duration_sec": duration_sec}, out)
+        _audit_relay_set((channel, state, duration_sec), out)
         return out
     if state == 1 and duration_sec == 0 and not safety_confirm:
         out = {
@@ -669,13 +1066,13 @@ def relay_set_mcp(
             "code": "CONFIRM_REQUIRED",
             "hint": "若只需短时动作，请设置 duration_sec；若确需持续开启，请显式确认。",
         }
-        _audit_tool_call("relay_set_mcp", {"channel": channel, "state": state, "duration_sec": duration_sec}, out)
+        _audit_relay_set((channel, state, duration_sec), out)
         return out
 
     port = _ensure_serial_port()
     if not port:
-        out = {"status": "error", "error": "未检测到串口设备", "code": "PORT_MISSING"}
-        _audit_tool_call("relay_set_mcp", {"channel": channel, "state": state, "duration_sec": duration_sec}, out)
+        out = {**_PORT_MISSING_TMPL, "error": "未检测到串口设备"}
+        _audit_relay_set((channel, state, duration_sec), out)
         return out
 
     device_id = _RELAY1_DEVICE_ID if channel == 1 else _RELAY2_DEVICE_ID
@@ -687,7 +1084,7 @@ def relay_set_mcp(
     out["duration_sec"] = duration_sec
 
     if not out.get("completed"):
-        _audit_tool_call("relay_set_mcp", {"channel": channel, "state": state, "duration_sec": duration_sec}, out)
+        _audit_relay_set((channel, state, duration_sec), out)
         return out
 
     if verify:
@@ -701,17 +1098,7 @@ def relay_set_mcp(
         if not verify_result.get("matched"):
             out["status"] = "failed"
             out["hint"] = "动作已下发但状态未达成，建议检查继电器供电与引脚接线。"
-            _audit_tool_call(
-                "relay_set_mcp",
-                {
-                    "channel": channel,
-                    "state": state,
-                    "duration_sec": duration_sec,
-                    "verify": verify,
-                    "verify_retries": verify_retries,
-                },
-                out,
-            )
+            _audit_relay_set_verified((channel, state, duration_sec, verify, verify_retries), out)
             return out
 
     if state == 1 and duration_sec > 0:
@@ -748,17 +1135,7 @@ def relay_set_mcp(
     if not verify:
         out["action_applied"] = bool(out.get("completed"))
 
-    _audit_tool_call(
-        "relay_set_mcp",
-        {
-            "channel": channel,
-            "state": state,
-            "duration_sec": duration_sec,
-            "verify": verify,
-            "verify_retries": verify_retries,
-        },
-        out,
-    )
+    _audit_relay_set_verified((channel, state, duration_sec, verify, verify_retries), out)
     return out
 
 
@@ -803,7 +1180,7 @@ def relay_all_off_mcp(timeout_ms: int = 5000, verify: bool = True, verify_retrie
     """关闭两路继电器，作为安全回落操作。"""
     port = _ensure_serial_port()
     if not port:
-        out = {"status": "error", "error": "未检测到串口设备", "code": "PORT_MISSING"}
+        out = {**_PORT_MISSING_TMPL, "error": "未检测到串口设备"}
         _audit_tool_call("relay_all_off_mcp", {"timeout_ms": timeout_ms}, out)
         return out
 
@@ -835,9 +1212,11 @@ def device_self_check_mcp(
     timeout_ms: int = 5000,
 ) -> Dict[str, Any]:
     """执行设备自检：串口、拓扑、传感器采样，并可选继电器写入检查。"""
-    serial_cfg = check_serial_config_mcp()
+    # 只有拓扑读取与串口探测无关；配置检查须等探测改写完串口后再读
+    topology_fut = _check_pool.submit(get_hardware_topology_mcp)
     detected = detect_and_connect_mcp()
-    topology = get_hardware_topology_mcp()
+    serial_cfg = check_serial_config_mcp()
+    topology = topology_fut.result()
     snapshot = read_environment_snapshot_mcp(samples=2, sample_interval_ms=150, timeout_ms=timeout_ms)
 
     relay_check: Dict[str, Any] = {"skipped": True}
@@ -846,7 +1225,7 @@ def device_self_check_mcp(
         relay_check["skipped"] = False
 
     checks = {
-        "serial_ready": serial_cfg.get("status") == "ok" or bool(os.getenv("MCP_SERIAL_PORT", "")),
+        "serial_ready": serial_cfg.get("status") == "ok" or bool(_serial_port_env),
         "topology_ready": bool(topology.get("devices")),
         "sensors_ready": snapshot.get("status") == "success",
         "relay_write_ready": relay_check.get("status") == "success" if include_relay_write_check else None,
@@ -898,15 +1277,15 @@ def evaluate_environment_thresholds_mcp(
 ) -> Dict[str, Any]:
     """按阈值评估环境状态，输出 INFO/WARN/CRITICAL。"""
     if not (0 <= water_warn_high <= water_critical_high <= 1024):
-        out = {"status": "error", "error": "水位阈值不合法", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "水位阈值不合法"}
         _audit_tool_call("evaluate_environment_thresholds_mcp", {}, out)
         return out
     if not (-40 <= temp_warn_high <= temp_critical_high <= 125):
-        out = {"status": "error", "error": "温度阈值不合法", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "温度阈值不合法"}
         _audit_tool_call("evaluate_environment_thresholds_mcp", {}, out)
         return out
     if not (0 <= humidity_warn_high <= humidity_critical_high <= 100):
-        out = {"status": "error", "error": "湿度阈值不合法", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "湿度阈值不合法"}
         _audit_tool_call("evaluate_environment_thresholds_mcp", {}, out)
         return out
 
@@ -1003,18 +1382,20 @@ def run_safety_control_mcp(
 ) -> Dict[str, Any]:
     """安全联动入口：先评估阈值，再按策略执行受控继电器动作。"""
     mode = (action_mode or "none").strip().lower()
-    allowed_modes = {"none", "all_off", "pulse_relay"}
-    if mode not in allowed_modes:
+    if mode not in _SAFETY_ACTION_MODES:
         out = {
-            "status": "error",
+            **_BAD_ARG_TMPL,
             "error": f"action_mode 不支持: {action_mode}",
-            "allowed": sorted(allowed_modes),
-            "code": "BAD_ARG",
+            "allowed": sorted(_SAFETY_ACTION_MODES),
         }
         _audit_tool_call("run_safety_control_mcp", {"action_mode": action_mode}, out)
         return out
 
-    eval_result = evaluate_environment_thresholds_mcp(timeout_ms=timeout_ms)
+    if force_action and mode != "none":
+        # 强制动作不看评估结果，跳过三轮传感器采样
+        eval_result = {"status": "success", "overall_level": "FORCED", "alerts": [], "snapshot": None}
+    else:
+        eval_result = evaluate_environment_thresholds_mcp(timeout_ms=timeout_ms)
     if eval_result.get("status") != "success":
         out = {
             "status": "failed",
@@ -1025,7 +1406,7 @@ def run_safety_control_mcp(
         return out
 
     level = eval_result.get("overall_level", "INFO")
-    should_act = level in ("WARN", "CRITICAL")
+    should_act = level in _ALERT_LEVELS
     if critical_only:
         should_act = level == "CRITICAL"
     if force_action:
@@ -1093,7 +1474,7 @@ def run_safety_control_mcp(
 
 
 @app.tool()
-def execute_m_logic_mcp(
+async def execute_m_logic_mcp(
     m_tokens: List[int],
     timeout_ms: int = 5000,
 ) -> Dict[str, Any]:
@@ -1107,7 +1488,7 @@ def execute_m_logic_mcp(
         成功: {"result": 数值, "steps": 执行步数, "completed": true}
         失败: {"fault_code": 错误码, "fault": "错误名", "completed": false}
     """
-    out = execute_m_logic(m_tokens, timeout_ms)
+    out = await execute_m_logic_async(m_tokens, timeout_ms)
     _audit_tool_call("execute_m_logic_mcp", {"m_tokens": m_tokens, "timeout_ms": timeout_ms}, out)
     return out
 
@@ -1178,9 +1559,16 @@ def execute_lir_action_mcp(
 @app.tool()
 def check_serial_config_mcp() -> Dict[str, Any]:
     """检查串口配置。"""
-    import os
-    port = os.getenv("MCP_SERIAL_PORT", "").strip()
-    baud = os.getenv("MCP_BAUD", "115200")
+    global _serial_cfg_cache
+    port = _serial_port_env
+    baud = _BAUD
+
+    # 纯配置探测：配置未变且在 TTL 内直接复用上次枚举结果
+    cached = _serial_cfg_cache
+    if cached is not None and cached[0] == (port, baud) and time.monotonic() - cached[1] < _SERIAL_CFG_TTL_SEC:
+        out = dict(cached[2])
+        _audit_tool_call("check_serial_config_mcp", {}, out)
+        return out
 
     if not port:
         out = {
@@ -1194,12 +1582,11 @@ def check_serial_config_mcp() -> Dict[str, Any]:
         _audit_tool_call("check_serial_config_mcp", {}, out)
         return out
 
-    try:
-        import serial.tools.list_ports
-        available = [p.device for p in serial.tools.list_ports.comports()]
-    except Exception:
-        available = []
-    port_exists = port in available
+    available = [p.device for p in _list_ports_cached()]
+    if _IS_WINDOWS and _COM_RE.match(port):
+        port_exists = port.upper() in {d.upper() for d in available}
+    else:
+        port_exists = port in available
 
     out = {
         "status": "ok" if port_exists else "port_not_found",
@@ -1209,6 +1596,7 @@ def check_serial_config_mcp() -> Dict[str, Any]:
         "available_ports": available,
         "hint": f"Ensure ESP8266 is connected to {port}" if port_exists else f"Port {port} not found. Check connection."
     }
+    _serial_cfg_cache = ((port, baud), time.monotonic(), dict(out))
     _audit_tool_call("check_serial_config_mcp", {}, out)
     return out
 
@@ -1216,10 +1604,8 @@ def check_serial_config_mcp() -> Dict[str, Any]:
 @app.tool()
 def detect_and_connect_mcp() -> Dict[str, Any]:
     """自动检测并连接 ESP8266 串口。"""
-    import os
-
-    # 调用 core 中的串口检测函数
-    detected = detect_serial_ports()
+    # 调用 core 中的串口检测函数（复用短 TTL 的枚举结果）
+    detected = detect_serial_ports(_list_ports_cached() if _list_ports is not None else None)
 
     if detected["status"] == "error":
         out = {
@@ -1234,18 +1620,15 @@ def detect_and_connect_mcp() -> Dict[str, Any]:
 
     # 构建快速操作命令，并自动更新当前进程串口配置。
     updated_port = None
-    previous_port = os.getenv("MCP_SERIAL_PORT", "").strip()
+    previous_port = _serial_port_env
     if detected.get("suggested_port"):
         port = detected["suggested_port"]["device"]
-        os.environ["MCP_SERIAL_PORT"] = port
+        _set_serial_port(port)
+        _invalidate_port_cache()
         updated_port = port
         # Port switch often means previous failures are stale; clear breaker state.
-        with _circuit_lock:
-            for st in _circuit_state.values():
-                st["failures"] = 0
-                st["open_until"] = 0.0
-        os_name = os.name
-        if os_name == "nt":  # Windows
+        _reset_circuits()
+        if _IS_WINDOWS:  # Windows
             quick_action = f"$env:MCP_SERIAL_PORT='{port}'"
         else:  # Linux/Mac
             quick_action = f"export MCP_SERIAL_PORT='{port}'"
@@ -1283,14 +1666,14 @@ def get_guard_status_mcp() -> Dict[str, Any]:
     """查看熔断器状态与守护配置。"""
     now = time.time()
     circuits: Dict[str, Any] = {}
-    with _circuit_lock:
-        for key, st in _circuit_state.items():
-            open_until = float(st.get("open_until", 0.0))
-            circuits[key] = {
-                "failures": int(st.get("failures", 0)),
-                "is_open": open_until > now,
-                "retry_after_sec": max(0, int(round(open_until - now))),
-            }
+    for key, st in _circuit_state.items():
+        state, failures, open_until = st.state
+        circuits[key] = {
+            "state": _CIRCUIT_STATE_NAMES[state],
+            "failures": failures,
+            "is_open": state == _CIRCUIT_TRIPPED and open_until > now,
+            "retry_after_sec": max(0, int(round(open_until - now))),
+        }
     out = {
         "status": "success",
         "config": {
@@ -1306,27 +1689,49 @@ def get_guard_status_mcp() -> Dict[str, Any]:
     return out
 
 
+_TAIL_BUFSIZE = 65536
+
+
+def _tail_lines(path: Path, n: int) -> List[bytes]:
+    """从文件尾部按块倒读，只取最后 n 行（不整文件读入）。"""
+    with _audit_lock:
+        with path.open("rb") as f:
+            remaining = f.seek(0, os.SEEK_END)
+            acc = b""
+            while remaining > 0 and acc.count(b"\n") <= n:
+                chunk = min(_TAIL_BUFSIZE, remaining)
+                remaining -= chunk
+                f.seek(remaining)
+                acc = f.read(chunk) + acc
+    return acc.splitlines()[-n:]
+
+
 @app.tool()
 def get_recent_audit_events_mcp(limit: int = 50) -> Dict[str, Any]:
-    """读取最近审计事件（JSONL）。"""
-    if limit < 1 or limit > 1000:
-        out = {"status": "error", "error": "limit 必须在 1~1000 之间", "code": "BAD_ARG"}
-        _audit_tool_call("get_recent_audit_events_mcp", {"limit": limit}, out)
-        return out
-    if not _audit_file.exists():
-        out = {"status": "success", "events": [], "count": 0}
-        _audit_tool_call("get_recent_audit_events_mcp", {"limit": limit}, out)
+    """读取最近审计事件（JSONL），limit 会被截到 1~1000。"""
+    limit = max(1, min(limit, 1000))
+    with _recent_lock:
+        if len(_recent_events) >= limit:
+            # 浅拷贝：调用方改动返回值不会污染内存窗口（及尚未落盘的队列记录）
+            events = [dict(e) for e in itertools.islice(_recent_events, len(_recent_events) - limit, None)]
+        else:
+            events = None
+    if events is not None:
+        out = {"status": "success", "events": events, "count": len(events)}
+        _audit_tool_call("get_recent_audit_events_mcp", {"limit": limit}, {"status": "success", "count": len(events)})
         return out
+    _flush_audit()
+    try:
+        lines = _tail_lines(_audit_file, limit)
+    except FileNotFoundError:
+        lines = []
 
-    lines: List[str] = []
-    with _audit_lock:
-        with _audit_file.open("r", encoding="utf-8") as f:
-            lines = f.readlines()
-    sliced = lines[-limit:]
     events = []
-    for line in sliced:
+    for line in lines:
+        if not line:
+            continue
         try:
-            events.append(json.loads(line))
+            events.append(_json_loads(line))
         except Exception:
             continue
     out = {"status": "success", "events": events, "count": len(events)}
@@ -1338,20 +1743,7 @@ def get_recent_audit_events_mcp(limit: int = 50) -> Dict[str, Any]:
 def reset_guard_mcp(target: str = "all") -> Dict[str, Any]:
     """手动重置熔断状态。target 可为 all 或具体 key（如 read:2）。"""
     tgt = (target or "all").strip()
-    cleared: List[str] = []
-
-    with _circuit_lock:
-        if tgt == "all":
-            for key, st in _circuit_state.items():
-                st["failures"] = 0
-                st["open_until"] = 0.0
-                cleared.append(key)
-        else:
-            st = _circuit_state.get(tgt)
-            if st is not None:
-                st["failures"] = 0
-                st["open_until"] = 0.0
-                cleared.append(tgt)
+    cleared = _reset_circuits(tgt)
 
     out = {
         "status": "success",
@@ -1371,17 +1763,16 @@ def set_fault_injection_mcp(
 ) -> Dict[str, Any]:
     """设置可控故障注入开关（off/port_drop/timeout_read/timeout_write）。"""
     normalized = (mode or "off").strip().lower()
-    allowed = {"off", "port_drop", "timeout_read", "timeout_write"}
-    if normalized not in allowed:
-        out = {"status": "error", "error": f"mode 不支持: {mode}", "allowed": sorted(allowed), "code": "BAD_ARG"}
+    if normalized not in _FAULT_MODES:
+        out = {**_BAD_ARG_TMPL, "error": f"mode 不支持: {mode}", "allowed": sorted(_FAULT_MODES)}
         _audit_tool_call("set_fault_injection_mcp", {"mode": mode, "every_n": every_n, "duration_sec": duration_sec}, out)
         return out
     if every_n < 1:
-        out = {"status": "error", "error": "every_n 必须 >= 1", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "every_n 必须 >= 1"}
         _audit_tool_call("set_fault_injection_mcp", {"mode": mode, "every_n": every_n, "duration_sec": duration_sec}, out)
         return out
     if duration_sec < 0:
-        out = {"status": "error", "error": "duration_sec 不能为负数", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "duration_sec 不能为负数"}
         _audit_tool_call("set_fault_injection_mcp", {"mode": mode, "every_n": every_n, "duration_sec": duration_sec}, out)
         return out
 
@@ -1430,22 +1821,21 @@ def run_experiment_batch_mcp(
     output_tag: str = "",
 ) -> Dict[str, Any]:
     """批量运行实验并输出统计结果到 data/mcp/experiments。"""
-    supported = {"relay_closed_loop", "relay_baseline"}
     normalized_case = (case or "").strip().lower()
-    if normalized_case not in supported:
-        out = {"status": "error", "error": f"case 不支持: {case}", "supported": sorted(supported), "code": "BAD_ARG"}
+    if normalized_case not in _EXPERIMENT_CASES:
+        out = {**_BAD_ARG_TMPL, "error": f"case 不支持: {case}", "supported": sorted(_EXPERIMENT_CASES)}
         _audit_tool_call("run_experiment_batch_mcp", {"case": case, "runs": runs}, out)
         return out
     if runs < 1 or runs > 500:
-        out = {"status": "error", "error": "runs 必须在 1~500", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "runs 必须在 1~500"}
         _audit_tool_call("run_experiment_batch_mcp", {"case": case, "runs": runs}, out)
         return out
     if channel not in (1, 2):
-        out = {"status": "error", "error": "channel 仅支持 1/2", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "channel 仅支持 1/2"}
         _audit_tool_call("run_experiment_batch_mcp", {"case": case, "channel": channel}, out)
         return out
     if interval_ms < 0 or interval_ms > 10000:
-        out = {"status": "error", "error": "interval_ms 必须在 0~10000", "code": "BAD_ARG"}
+        out = {**_BAD_ARG_TMPL, "error": "interval_ms 必须在 0~10000"}
         _audit_tool_call("run_experiment_batch_mcp", {"case": case, "interval_ms": interval_ms}, out)
         return out
 
@@ -1536,38 +1926,78 @@ def run_experiment_batch_mcp(
     return out
 
 
+def _recent_fail_window(limit: int) -> List[Dict[str, Any]] | None:
+    """最近 limit 条审计事件中的失败事件；内存中的记录不足以覆盖该窗口时返回 None。"""
+    with _recent_lock:
+        if _audit_seq < limit:
+            return None
+        floor = _audit_seq - limit
+        fails = _recent_fail_events
+        if len(fails) == fails.maxlen and fails[0][0] > floor + 1:
+            return None
+        return [dict(ev) for seq, ev in fails if seq > floor]
+
+
 @app.tool()
-def mcp_health_report_mcp(recent_limit: int = 20) -> Dict[str, Any]:
-    """统一健康报告：串口、设备自检、守护状态、最近审计摘要。"""
+def mcp_health_report_mcp(recent_limit: int = 20, audit_on_failure: bool = False) -> Dict[str, Any]:
+    """统一健康报告：串口、设备自检、守护状态、最近审计摘要。
+
+    结论已是 failed 时默认跳过审计读取，audit_on_failure=True 可强制读取。
+    """
+    global _health_check_fut
+    with _health_check_lock:
+        self_check_fut = _health_check_fut
+        if self_check_fut is None or self_check_fut.done():
+            self_check_fut = _health_pool.submit(
+                device_self_check_mcp, include_relay_write_check=False, timeout_ms=3000
+            )
+            _health_check_fut = self_check_fut
+    try:
+        self_check = self_check_fut.result(timeout=_HEALTH_SELF_CHECK_TIMEOUT_SEC)
+    except FutureTimeoutError:
+        # 自检卡住时不拖住整份报告；后台任务自行结束
+        self_check = {
+            "status": "failed",
+            "health_status": "failed",
+            "error": f"device self-check timed out after {_HEALTH_SELF_CHECK_TIMEOUT_SEC:g}s",
+        }
+    # 串口配置与守护状态都在自检之后读取：自检会重新探测串口、清空熔断
     serial_cfg = check_serial_config_mcp()
-    self_check = device_self_check_mcp(include_relay_write_check=False, timeout_ms=3000)
     guard = get_guard_status_mcp()
-    recent = get_recent_audit_events_mcp(limit=recent_limit)
 
-    guard_circuits = guard.get("circuits", {})
-    open_circuits = [k for k, v in guard_circuits.items() if bool(v.get("is_open"))]
+    # get_guard_status_mcp 总会给出 circuits 与 is_open，直接索引
+    open_circuits = [k for k, v in guard["circuits"].items() if v["is_open"]]
 
-    recent_events = recent.get("events", []) if recent.get("status") == "success" else []
-    fail_events = []
-    for ev in recent_events:
-        if not isinstance(ev, dict):
-            continue
-        st = ev.get("status")
-        if st in ("failed", "error", "blocked"):
-            fail_events.append(ev)
-
-    if self_check.get("health_status") == "failed" or open_circuits:
+    self_health = self_check.get("health_status")
+    if self_health == "failed" or open_circuits:
         overall = "failed"
-    elif self_check.get("health_status") == "degraded":
+    elif self_health == "degraded":
         overall = "degraded"
     else:
         overall = "ok"
 
+    # 已判定 failed 时不再读审计（可能要回退读文件）；内存里的失败窗口照常给出
+    recent = None if overall == "failed" and not audit_on_failure else get_recent_audit_events_mcp(limit=recent_limit)
+    fail_events = _recent_fail_window(recent_limit)
+    if fail_events is None:
+        # 内存窗口覆盖不到（刚启动或失败事件过多），回退到逐条扫描
+        recent_events = recent["events"] if recent is not None and recent.get("status") == "success" else ()
+        fail_set = _FAIL_STATUSES
+        fail_events = [ev for ev in recent_events if type(ev) is dict and ev.get("status") in fail_set]
+
+    # 只有摘要里的 recent_fail_events 为空时省略；其余字段（含 open_circuits）始终输出
+    if recent is None:
+        audit_summary: Dict[str, Any] = {"limit": recent_limit, "skipped": True}
+    else:
+        audit_summary = {"limit": recent_limit, "count": recent.get("count", 0)}
+    if fail_events:
+        audit_summary["recent_fail_events"] = fail_events[-10:]
+
     out = {
         "status": "success",
         "overall_health": overall,
         "serial_status": serial_cfg.get("status"),
-        "self_check_health": self_check.get("health_status"),
+        "self_check_health": self_health,
         "open_circuits": open_circuits,
         "open_circuit_count": len(open_circuits),
         "recent_fail_event_count": len(fail_events),
@@ -1575,14 +2005,12 @@ def mcp_health_report_mcp(recent_limit: int = 20) -> Dict[str, Any]:
             "serial_config": serial_cfg,
             "self_check": self_check,
             "guard_status": guard,
-            "recent_audit_summary": {
-                "limit": recent_limit,
-                "count": recent.get("count", 0),
-                "recent_fail_events": fail_events[-10:],
-            },
+            "recent_audit_summary": audit_summary,
         },
     }
-    _audit_tool_call("mcp_health_report_mcp", {"recent_limit": recent_limit}, out)
+    _audit_tool_call(
+        "mcp_health_report_mcp", {"recent_limit": recent_limit, "audit_on_failure": audit_on_failure}, out
+    )
     return out
 
 
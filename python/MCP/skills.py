@@ -1,11 +1,17 @@
 ﻿from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any, Callable, Dict
 
 
 ToolFn = Callable[..., Dict[str, Any]]
 
+_ALLOWED_STRATEGIES = frozenset(("auto", "emergency_stop", "pulse"))
+
+# 互不依赖的工具调用并发下发；串口往返仍由 core 串行化。模块级共享，不随引擎实例泄漏线程
+_skill_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="skill")
+
 
 @dataclass
 class SkillEngine:
@@ -26,12 +32,14 @@ class SkillEngine:
         include_relay_write_check: bool = False,
         recent_limit: int = 20,
     ) -> Dict[str, Any]:
+        # 自检会重新探测串口并清空熔断（健康报告内部也会自检），必须先单独跑完，之后只并发两个只读调用
         self_check = self.device_self_check(
             include_relay_write_check=include_relay_write_check,
             timeout_ms=4000,
         )
-        health = self.health_report(recent_limit=recent_limit)
-        recent = self.recent_audit(limit=min(max(recent_limit, 1), 100))
+        f_health = _skill_pool.submit(self.health_report, recent_limit=recent_limit)
+        f_recent = _skill_pool.submit(self.recent_audit, limit=min(max(recent_limit, 1), 100))
+        health, recent = f_health.result(), f_recent.result()
 
         health_level = str(health.get("overall_health", "degraded"))
         if health_level == "ok":
@@ -64,8 +72,9 @@ class SkillEngine:
         samples: int = 3,
         timeout_ms: int = 5000,
     ) -> Dict[str, Any]:
-        snap = self.snapshot(samples=samples, sample_interval_ms=200, timeout_ms=timeout_ms)
-        eval_result = self.threshold_eval(samples=samples, timeout_ms=timeout_ms)
+        f_snap = _skill_pool.submit(self.snapshot, samples=samples, sample_interval_ms=200, timeout_ms=timeout_ms)
+        f_eval = _skill_pool.submit(self.threshold_eval, samples=samples, timeout_ms=timeout_ms)
+        snap, eval_result = f_snap.result(), f_eval.result()
 
         level = str(eval_result.get("overall_level", "WARN")) if eval_result.get("status") == "success" else "WARN"
         if level == "CRITICAL":
@@ -95,7 +104,7 @@ class SkillEngine:
         timeout_ms: int = 5000,
     ) -> Dict[str, Any]:
         plan = (strategy or "auto").strip().lower()
-        if plan not in {"auto", "emergency_stop", "pulse"}:
+        if plan not in _ALLOWED_STRATEGIES:
             return {
                 "status": "error",
                 "skill": "safe_control",
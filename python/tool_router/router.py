@@ -1,14 +1,23 @@
 import asyncio
+import importlib.util
 import json
+import logging
 import os
 import signal
 import sys
-from typing import Any, Dict, List
+import time
+from typing import Any, AsyncIterator, Dict, List
 from asyncio import timeout as asyncio_timeout
 
 import httpx
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 import anyio
 
@@ -17,13 +26,68 @@ from mcp.client.streamable_http import streamable_http_client
 
 from contextlib import asynccontextmanager
 
+logger = logging.getLogger("router")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stderr)
+    _log_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.getenv("ROUTER_LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+# Event loop: uvicorn's default `--loop auto` already runs on uvloop when it is
+# installed (see requirements.txt), so the router does not install a policy itself.
+
 # Configuration - Local Ollama
 OLLAMA_BASE = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+_OLLAMA_ROOT = (OLLAMA_BASE or "").rstrip("/")
+# OpenAI-compatible endpoint; OLLAMA_BASE_URL may or may not already end in /v1
+CHAT_URL = f"{_OLLAMA_ROOT}/chat/completions" if _OLLAMA_ROOT.endswith("/v1") else f"{_OLLAMA_ROOT}/v1/chat/completions"
+TAGS_URL = f"{_OLLAMA_ROOT}/api/tags"
 DEFAULT_MODEL = os.getenv("OLLAMA_MODEL", "qwen3:32b")
 MAX_TOOL_ROUNDS = int(os.getenv("TOOL_MAX_ROUNDS", "4"))
+# Per tool message cap (UTF-8 bytes); results are re-sent every later round. 0 disables.
+MAX_TOOL_RESULT_BYTES = int(os.getenv("MAX_TOOL_RESULT_BYTES", "16000"))
 MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT_SEC", "20"))
-MCP_CONNECT_RETRIES = int(os.getenv("MCP_CONNECT_RETRIES", "3"))
+MCP_CONNECT_MAX_DELAY = float(os.getenv("MCP_CONNECT_MAX_DELAY_SEC", "30"))
 MCP_CONNECT_RETRY_DELAY = float(os.getenv("MCP_CONNECT_RETRY_DELAY_SEC", "1.5"))
+MCP_MAX_CONCURRENCY = int(os.getenv("MCP_MAX_CONCURRENCY", "8"))
+MCP_TOOLS_TTL = float(os.getenv("MCP_TOOLS_TTL_SEC", "30"))
+# Ollama usually generates one or a few requests at a time; size the pool to match
+OLLAMA_MAX_INFLIGHT = int(os.getenv("OLLAMA_MAX_INFLIGHT", "4"))
+OLLAMA_MODELS_TTL = float(os.getenv("OLLAMA_MODELS_TTL_SEC", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("ROUTER_HTTP_MAX_CONNECTIONS", "8"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("ROUTER_HTTP_MAX_KEEPALIVE", "8"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("ROUTER_HTTP_KEEPALIVE_EXPIRY_SEC", "60"))
+# httpx only speaks HTTP/2 when the optional h2 package is installed
+_H2_AVAILABLE = importlib.util.find_spec("h2") is not None
+# HTTP/2 is only negotiated over TLS (e.g. Ollama behind an https proxy); plain http stays HTTP/1.1
+HTTP2 = os.getenv("ROUTER_HTTP2", "0") == "1" and _H2_AVAILABLE
+HTTP_CONNECT_TIMEOUT = float(os.getenv("ROUTER_HTTP_CONNECT_TIMEOUT_SEC", "10"))
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _dumpb(obj: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes; orjson when available, stdlib for what it rejects."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps(obj: Any, indent: bool = False) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+
+_loads = orjson.loads if orjson is not None else json.loads
+STREAM_CHUNK_BYTES = 65536
 
 # MCP URL
 raw_mcp_url = os.getenv("MCP_HTTP_URL", "http://127.0.0.1:9001/mcp")
@@ -36,59 +100,111 @@ _mcp_session_cm = None
 _mcp_read = None
 _mcp_write = None
 _mcp_get_session_id = None
-_mcp_lock = asyncio.Lock()
+# Bounds concurrent tool calls on the shared MCP session (requests are multiplexed by id)
+_mcp_call_sem = asyncio.Semaphore(max(1, MCP_MAX_CONCURRENCY))
+# Backpressure on upstream generations; excess requests queue here instead of opening sockets
+_ollama_sem = asyncio.Semaphore(max(1, OLLAMA_MAX_INFLIGHT))
 _mcp_init_lock = asyncio.Lock()
+# Set while a session is usable (mirrors _mcp_session is not None); for code that wants to await readiness
+_mcp_ready = asyncio.Event()
+# Wakes the background connector when the session is dropped
+_mcp_reconnect = asyncio.Event()
 _mcp_connection_error: str | None = None
+# (monotonic timestamp, OpenAI-format tool list, its JSON bytes); dropped whenever the session resets
+_tools_cache: tuple[float, List[Dict[str, Any]], bytes] | None = None
+# (monotonic timestamp, model names) from Ollama /api/tags
+_models_cache: tuple[float, List[str]] | None = None
+
+# Shared upstream HTTP client (keep-alive to Ollama); created in lifespan
+_http: httpx.AsyncClient | None = None
+
+
+def _new_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            max_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(300.0, connect=HTTP_CONNECT_TIMEOUT),
+        http2=HTTP2,
+    )
+
+
+def _http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it lazily when used outside lifespan."""
+    global _http
+    if _http is None or _http.is_closed:
+        _http = _new_http_client()
+    return _http
+
+
+async def _close_http_client() -> None:
+    global _http
+    client, _http = _http, None
+    if client is not None:
+        await client.aclose()
 
 
 async def _ensure_mcp_session() -> ClientSession | None:
-    """Ensure we have a valid MCP session, return None if unavailable."""
+    """Make one connection attempt if there is no session; return None if unavailable."""
     global _mcp_session, _mcp_session_cm, _mcp_read, _mcp_write, _mcp_cm, _mcp_get_session_id, _mcp_connection_error
-    
+
     if _mcp_session is not None:
         return _mcp_session
-    
+
     async with _mcp_init_lock:
         if _mcp_session is not None:
             return _mcp_session
 
-        last_error: str | None = None
-        for attempt in range(1, max(1, MCP_CONNECT_RETRIES) + 1):
-            try:
-                print(
-                    f"[MCP] Connecting to {MCP_HTTP_URL} "
-                    f"(attempt {attempt}/{MCP_CONNECT_RETRIES}, timeout={MCP_CONNECT_TIMEOUT}s)...",
-                    file=sys.stderr,
-                )
-                _mcp_cm = streamable_http_client(MCP_HTTP_URL)
-                async with asyncio_timeout(MCP_CONNECT_TIMEOUT):
-                    _mcp_read, _mcp_write, _mcp_get_session_id = await _mcp_cm.__aenter__()
-                _mcp_session_cm = ClientSession(_mcp_read, _mcp_write)
-                async with asyncio_timeout(MCP_CONNECT_TIMEOUT):
-                    _mcp_session = await _mcp_session_cm.__aenter__()
-                    await _mcp_session.initialize()
-                print("[MCP] Connected successfully!", file=sys.stderr)
-                _mcp_connection_error = None
-                return _mcp_session
-            except asyncio.TimeoutError:
-                last_error = f"MCP connection timeout ({MCP_CONNECT_TIMEOUT}s)"
-            except Exception as e:
-                last_error = str(e)
-
-            # Cleanup partial state before next retry.
-            await _reset_mcp_session()
-            _mcp_connection_error = last_error
-            print(f"[MCP] Connection failed (attempt {attempt}): {last_error}", file=sys.stderr)
-            if attempt < MCP_CONNECT_RETRIES:
-                await asyncio.sleep(MCP_CONNECT_RETRY_DELAY)
-
+        try:
+            logger.info("[MCP] Connecting to %s (timeout=%ss)...", MCP_HTTP_URL, MCP_CONNECT_TIMEOUT)
+            _mcp_cm = streamable_http_client(MCP_HTTP_URL)
+            async with asyncio_timeout(MCP_CONNECT_TIMEOUT):
+                _mcp_read, _mcp_write, _mcp_get_session_id = await _mcp_cm.__aenter__()
+            _mcp_session_cm = ClientSession(_mcp_read, _mcp_write)
+            async with asyncio_timeout(MCP_CONNECT_TIMEOUT):
+                session = await _mcp_session_cm.__aenter__()
+                await session.initialize()
+            logger.info("[MCP] Connected successfully!")
+            _mcp_connection_error = None
+            # Publish only once initialized: a non-None _mcp_session always means ready
+            _mcp_session = session
+            _mcp_ready.set()
+            return session
+        except asyncio.TimeoutError:
+            last_error = f"MCP connection timeout ({MCP_CONNECT_TIMEOUT}s)"
+        except Exception as e:
+            last_error = str(e)
+
+        # Cleanup partial state; the background connector retries.
+        await _reset_mcp_session()
+        _mcp_connection_error = last_error
+        logger.warning("[MCP] Connection failed: %s", last_error)
         return None
 
 
+async def _connect_mcp_forever() -> None:
+    """Background connector: (re)establish the MCP session with exponential backoff."""
+    delay = MCP_CONNECT_RETRY_DELAY
+    while True:
+        _mcp_reconnect.clear()
+        if _mcp_session is None and await _ensure_mcp_session() is None:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MCP_CONNECT_MAX_DELAY)
+            continue
+        delay = MCP_CONNECT_RETRY_DELAY
+        await _mcp_reconnect.wait()
+
+
 async def _reset_mcp_session() -> None:
     """Reset MCP session state."""
     global _mcp_session, _mcp_session_cm, _mcp_read, _mcp_write, _mcp_cm, _mcp_get_session_id, _mcp_connection_error
+    global _tools_cache
+    _mcp_ready.clear()
+    _mcp_reconnect.set()
     _mcp_session = None
+    _tools_cache = None
     if _mcp_session_cm is not None:
         try:
             await _mcp_session_cm.__aexit__(None, None, None)
@@ -107,33 +223,56 @@ async def _reset_mcp_session() -> None:
     _mcp_cm = None
 
 
+async def _reconnect_mcp(stale: ClientSession) -> ClientSession | None:
+    """Replace a session that was found closed.
+
+    Concurrent tool calls (and requests) that hit the same dead session share a
+    single reset: only the first caller still seeing `stale` tears it down, the
+    rest pick up whatever session is current afterwards.
+    """
+    async with _mcp_init_lock:
+        if _mcp_session is stale:
+            await _reset_mcp_session()
+    return await _ensure_mcp_session()
+
+
+def _mcp_unavailable() -> HTTPException:
+    """503 for requests that arrive while no MCP session is published."""
+    if _mcp_connection_error:
+        message = f"MCP server unavailable: {_mcp_connection_error}"
+    else:
+        message = "MCP connecting"
+    return HTTPException(
+        status_code=503,
+        detail={
+            "message": message,
+            "type": "mcp_unavailable",
+            "hint": "Make sure MCP server is running on " + MCP_HTTP_URL
+        }
+    )
+
+
 async def _mcp_tools() -> List[Dict[str, Any]]:
-    """Get list of available MCP tools."""
-    global _mcp_connection_error
-    
-    session = await _ensure_mcp_session()
+    """Get list of available MCP tools (cached for MCP_TOOLS_TTL seconds)."""
+    global _tools_cache
+
+    cached = _tools_cache
+    if cached is not None and time.monotonic() - cached[0] < MCP_TOOLS_TTL:
+        return cached[1]
+
+    session = _mcp_session
     if session is None:
-        if _mcp_connection_error:
-            raise HTTPException(
-                status_code=503,
-                detail={
-                    "message": f"MCP server unavailable: {_mcp_connection_error}",
-                    "type": "mcp_unavailable",
-                    "hint": "Make sure MCP server is running on " + MCP_HTTP_URL
-                }
-            )
-        return []
+        raise _mcp_unavailable()
     
     try:
         resp = await session.list_tools()
     except anyio.ClosedResourceError:
-        await _reset_mcp_session()
-        session = await _ensure_mcp_session()
+        session = await _reconnect_mcp(session)
         if session is None:
-            return []
+            raise _mcp_unavailable()
         resp = await session.list_tools()
     except Exception as e:
-        print(f"[MCP] Error listing tools: {e}", file=sys.stderr)
+        logger.warning("[MCP] Error listing tools: %s", e)
         return []
     
     tools = []
@@ -146,14 +285,15 @@ async def _mcp_tools() -> List[Dict[str, Any]]:
                 "parameters": t.inputSchema or {"type": "object", "properties": {}}
             }
         })
+    if tools:
+        # Keep the serialized schema too; _payload_bytes splices it into every request
+        _tools_cache = (time.monotonic(), tools, _dumpb(tools))
     return tools
 
 
 async def _call_tool(name: str, args: Dict[str, Any]) -> Any:
     """Call an MCP tool."""
-    global _mcp_connection_error
-    
-    session = await _ensure_mcp_session()
+    session = _mcp_session
     if session is None:
         if _mcp_connection_error:
             raise HTTPException(
@@ -168,75 +308,103 @@ async def _call_tool(name: str, args: Dict[str, Any]) -> Any:
     try:
         resp = await session.call_tool(name, args)
     except anyio.ClosedResourceError:
-        await _reset_mcp_session()
-        session = await _ensure_mcp_session()
+        session = await _reconnect_mcp(session)
         if session is None:
             raise HTTPException(status_code=503, detail="MCP server disconnected")
         resp = await session.call_tool(name, args)
     except Exception as e:
-        print(f"[MCP] Error calling tool {name}: {e}", file=sys.stderr)
+        logger.error("[MCP] Error calling tool %s: %s", name, e)
         raise HTTPException(status_code=500, detail=f"Tool call failed: {str(e)}")
     
     if hasattr(resp, "content"):
-        return [c.model_dump() if hasattr(c, "model_dump") else c for c in resp.content]
+        return [_content_item(c) for c in resp.content]
     return resp
 
 
-def _chat_url() -> str:
-    """Get the chat completions URL for local Ollama."""
-    base = (OLLAMA_BASE or "").rstrip("/")
-    if base.endswith("/v1"):
-        return f"{base}/chat/completions"
-    return f"{base}/v1/chat/completions"
+def _content_item(c: Any) -> Any:
+    """Convert one MCP content block; text blocks skip the full pydantic dump.
+
+    A single response may mix block types (text, image, resource), so this is
+    decided per item rather than from the first one.
+    """
+    text = getattr(c, "text", None)
+    if type(text) is str:
+        return {"type": "text", "text": text}
+    if hasattr(c, "model_dump"):
+        return c.model_dump()
+    return c
+
+
+async def _call_tool_bounded(name: str, args: Dict[str, Any]) -> Any:
+    async with _mcp_call_sem:
+        logger.debug("[Chat] Calling tool: %s", name)
+        return await _call_tool(name, args)
+
+
+def _payload_bytes(payload: Dict[str, Any]) -> bytes:
+    """Serialize a chat payload, reusing the cached tools JSON when it is the cached list."""
+    cached = _tools_cache
+    tools = payload.get("tools")
+    if tools is None or cached is None or tools is not cached[1]:
+        return _dumpb(payload)
+    rest = {k: v for k, v in payload.items() if k != "tools"}
+    if not rest:
+        return b'{"tools":' + cached[2] + b"}"
+    return b'{"tools":' + cached[2] + b"," + _dumpb(rest)[1:]
 
 
 async def _ollama_chat(payload: Dict[str, Any]) -> Dict[str, Any]:
     """Send chat request to local Ollama."""
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(_chat_url(), json=payload, timeout=300.0)
-        try:
-            data = resp.json()
-        except Exception:
-            raise HTTPException(
-                status_code=resp.status_code,
-                detail={
-                    "message": resp.text,
-                    "type": "upstream_non_json",
-                    "upstream_status": resp.status_code,
-                },
-            )
-        if resp.status_code != 200:
-            raise HTTPException(status_code=resp.status_code, detail=data)
-        return data
+    async with _ollama_sem:
+        resp = await _http_client().post(CHAT_URL, content=_payload_bytes(payload), headers=_JSON_HEADERS)
+    try:
+        data = _loads(await resp.aread())
+    except Exception:
+        raise HTTPException(
+            status_code=resp.status_code,
+            detail={
+                "message": resp.text,
+                "type": "upstream_non_json",
+                "upstream_status": resp.status_code,
+            },
+        )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code, detail=data)
+    return data
 
 
 async def _ollama_models() -> List[str]:
-    """Fetch available model names from local Ollama."""
-    base = (OLLAMA_BASE or "").rstrip("/")
-    url = f"{base}/api/tags"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, timeout=15.0)
-        if resp.status_code != 200:
-            raise HTTPException(
-                status_code=resp.status_code,
-                detail={
-                    "message": resp.text,
-                    "type": "upstream_model_list_failed",
-                    "upstream_status": resp.status_code,
-                },
-            )
-        data = resp.json()
-        models = data.get("models", []) if isinstance(data, dict) else []
-        names: List[str] = []
-        for model in models:
-            if not isinstance(model, dict):
-                continue
-            name = model.get("name")
-            if isinstance(name, str) and name.strip():
-                names.append(name.strip())
-        if not names:
-            names = [DEFAULT_MODEL]
-        return names
+    """Fetch available model names from local Ollama (cached for OLLAMA_MODELS_TTL seconds)."""
+    global _models_cache
+
+    cached = _models_cache
+    if cached is not None and time.monotonic() - cached[0] < OLLAMA_MODELS_TTL:
+        return cached[1]
+
+    resp = await _http_client().get(TAGS_URL, timeout=15.0)
+    if resp.status_code != 200:
+        _models_cache = None
+        raise HTTPException(
+            status_code=resp.status_code,
+            detail={
+                "message": resp.text,
+                "type": "upstream_model_list_failed",
+                "upstream_status": resp.status_code,
+            },
+        )
+    data = _loads(resp.content)
+    models = data.get("models", []) if isinstance(data, dict) else []
+    names: List[str] = []
+    for model in models:
+        if not isinstance(model, dict):
+            continue
+        name = model.get("name")
+        if isinstance(name, str) and name.strip():
+            names.append(name.strip())
+    if not names:
+        names = [DEFAULT_MODEL]
+    _models_cache = (time.monotonic(), names)
+    return names
 
 
 # FastAPI app setup with graceful shutdown
@@ -251,10 +419,18 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("[Router] Starting up...", file=sys.stderr)
-    print(f"[Router] Ollama: {OLLAMA_BASE}, Model: {DEFAULT_MODEL}", file=sys.stderr)
+    logger.info("[Router] Starting up...")
+    logger.info("[Router] Ollama: %s, Model: %s", OLLAMA_BASE, DEFAULT_MODEL)
+    _http_client()
+    connector = asyncio.create_task(_connect_mcp_forever())
     yield
-    print("[Router] Shutting down gracefully...", file=sys.stderr)
+    logger.info("[Router] Shutting down gracefully...")
+    connector.cancel()
+    try:
+        await connector
+    except asyncio.CancelledError:
+        pass
+    await _close_http_client()
     await _reset_mcp_session()
     shutdown_event.set()
 
@@ -271,8 +447,8 @@ async def _unhandled_exception_handler(_req: Request, exc: Exception):
 
 @app.get("/health")
 async def health() -> Dict[str, Any]:
-    """Health check endpoint."""
-    session = await _ensure_mcp_session()
+    """Health check endpoint (reports state; never blocks on a connect)."""
+    session = _mcp_session
     return {
         "status": "ok",
         "mcp_connected": session is not None,
@@ -289,27 +465,215 @@ async def list_models() -> Dict[str, Any]:
     }
 
 
+def _tool_result_text(result: Any) -> str:
+    """Flatten an MCP tool result into the text content of a tool message."""
+    if isinstance(result, list):
+        parts: List[str] = []
+        for item in result:
+            if isinstance(item, dict) and "text" in item:
+                parts.append(item["text"])
+            elif isinstance(item, str):
+                parts.append(item)
+            else:
+                parts.append(_dumps(item))
+        return "".join(parts).strip()
+    if isinstance(result, dict):
+        return _dumps(result, indent=True)
+    return str(result)
+
+
+def _coerce_args(raw: Any) -> Any:
+    """Tool-call arguments arrive as a JSON string or an already-parsed object."""
+    if not isinstance(raw, (str, bytes)):
+        return raw
+    try:
+        return _loads(raw) if raw else {}
+    except Exception:
+        return {}
+
+
+def _truncate_result(text: str) -> str:
+    """Cap a tool message at MAX_TOOL_RESULT_BYTES, keeping the head and marking the cut."""
+    cap = MAX_TOOL_RESULT_BYTES
+    if cap <= 0 or len(text) * 4 <= cap:
+        return text
+    raw = text.encode("utf-8")
+    if len(raw) <= cap:
+        return text
+    head = raw[:cap].decode("utf-8", "ignore")
+    return f"{head}\n...[truncated {len(raw) - len(head.encode('utf-8'))} bytes]"
+
+
+async def _run_tool_calls(tool_calls: List[Dict[str, Any]], messages: List[Dict[str, Any]]) -> None:
+    """Execute one round of tool calls and append the tool messages."""
+    fns = [tc.get("function", {}) for tc in tool_calls]
+    calls = [_call_tool_bounded(fn.get("name", ""), _coerce_args(fn.get("arguments") or b"{}")) for fn in fns]
+
+    # Independent tool calls overlap; results are appended in tool_call order
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    for tc, result in zip(tool_calls, results):
+        if isinstance(result, BaseException):
+            raise result
+        logger.debug("[Chat] Tool result: %.200s...", result)
+        messages.append({
+            "role": "tool",
+            "tool_call_id": tc.get("id", ""),
+            "content": _truncate_result(_tool_result_text(result))
+        })
+
+
+def _merge_tool_call_deltas(acc: Dict[int, Dict[str, Any]], deltas: List[Dict[str, Any]]) -> None:
+    """Accumulate streamed tool_call fragments (OpenAI delta format) by index."""
+    for d in deltas:
+        tc = acc.setdefault(d.get("index", len(acc)), {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+        if d.get("id"):
+            tc["id"] = d["id"]
+        fn = d.get("function") or {}
+        if fn.get("name"):
+            tc["function"]["name"] += fn["name"]
+        args = fn.get("arguments")
+        if isinstance(args, str):
+            tc["function"]["arguments"] += args
+        elif args is not None:
+            tc["function"]["arguments"] = args
+
+
+def _sse_error(message: str, upstream_status: int) -> bytes:
+    err = {"error": {"message": message, "type": "upstream_error", "upstream_status": upstream_status}}
+    return b"data: " + _dumpb(err) + b"\n\ndata: [DONE]\n\n"
+
+
+_STREAM_END = object()
+
+
+async def _pump_upstream(body: bytes, queue: "asyncio.Queue[Any]", raw: bool) -> None:
+    """Drain one upstream streaming response into queue while holding an Ollama slot.
+
+    The slot is released as soon as upstream finishes, however slowly the
+    downstream client reads. Failures are queued as exceptions.
+    """
+    try:
+        async with _ollama_sem, _http_client().stream("POST", CHAT_URL, content=body, headers=_JSON_HEADERS) as resp:
+            if resp.status_code != 200:
+                text = (await resp.aread()).decode("utf-8", "replace")
+                queue.put_nowait(HTTPException(status_code=resp.status_code, detail=text))
+                return
+            items = resp.aiter_raw(STREAM_CHUNK_BYTES) if raw else resp.aiter_lines()
+            async for item in items:
+                queue.put_nowait(item)
+    except Exception as e:
+        queue.put_nowait(e)
+    finally:
+        queue.put_nowait(_STREAM_END)
+
+
+async def _stream_chat(payload: Dict[str, Any], messages: List[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Stream the completion as SSE, resolving tool calls between rounds.
+
+    Content deltas are always forwarded as they arrive. Tool-call deltas and the
+    finish chunk of a tool round are held back; when the round finishes with
+    tool calls they are executed and the next round is streamed. The last
+    allowed round is passed through untouched.
+    """
+    payload["stream"] = True
+    for i in range(MAX_TOOL_ROUNDS + 1):
+        last_round = i == MAX_TOOL_ROUNDS
+        queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        pump = asyncio.create_task(_pump_upstream(_payload_bytes(payload), queue, raw=last_round))
+        tool_acc: Dict[int, Dict[str, Any]] = {}
+        content_parts: List[str] = []
+        finish_reason = None
+        held_finish = None
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, HTTPException):
+                    yield _sse_error(str(item.detail), item.status_code)
+                    return
+                if isinstance(item, Exception):
+                    logger.warning("[Chat] Stream round %d failed: %s", i, item)
+                    yield _sse_error(f"Upstream stream failed: {item}", 502)
+                    return
+                if last_round:
+                    yield item
+                    continue
+
+                if not item.startswith("data:"):
+                    continue
+                data = item[5:].strip()
+                if data == "[DONE]":
+                    continue
+                try:
+                    chunk = _loads(data)
+                except Exception:
+                    continue
+                choice = (chunk.get("choices") or [{}])[0]
+                delta = choice.get("delta") or {}
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+                if delta.get("tool_calls"):
+                    _merge_tool_call_deltas(tool_acc, delta["tool_calls"])
+                if delta.get("content"):
+                    content_parts.append(delta["content"])
+                if not delta.get("tool_calls") and not (choice.get("finish_reason") and tool_acc):
+                    yield f"{item}\n\n".encode()
+                    continue
+                # Tool round: forward only the content part of this chunk
+                if choice.get("finish_reason"):
+                    held_finish = item
+                if delta.get("content"):
+                    rest = {k: v for k, v in delta.items() if k != "tool_calls"}
+                    chunk["choices"] = [{**choice, "delta": rest, "finish_reason": None}]
+                    yield b"data: " + _dumpb(chunk) + b"\n\n"
+        finally:
+            pump.cancel()
+        if last_round:
+            return
+
+        # finish_reason decides; older Ollama builds report "stop" after tool-call deltas
+        if not tool_acc or not (finish_reason == "tool_calls" or finish_reason in (None, "stop")):
+            if held_finish is not None:
+                yield f"{held_finish}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+            return
+
+        tool_calls = [tool_acc[k] for k in sorted(tool_acc)]
+        logger.debug("[Chat] Stream round %d: %d tool calls", i, len(tool_calls))
+        assistant: Dict[str, Any] = {"role": "assistant", "tool_calls": tool_calls}
+        if content_parts:
+            assistant["content"] = "".join(content_parts)
+        messages.append(assistant)
+        try:
+            await _run_tool_calls(tool_calls, messages)
+        except HTTPException as e:
+            yield _sse_error(str(e.detail), e.status_code)
+            return
+        except Exception as e:
+            logger.error("[Chat] Tool round %d failed: %s", i, e)
+            yield _sse_error(f"Tool call failed: {e}", 500)
+            return
+        payload["messages"] = messages
+
+
 @app.post("/v1/chat/completions")
 async def chat_completions(req: Request) -> Dict[str, Any]:
-    print(f"[Chat] Received request", file=sys.stderr)
+    logger.debug("[Chat] Received request")
     
     body = await req.json()
-    print(f"[Chat] Body: {json.dumps(body, ensure_ascii=False)[:500]}...", file=sys.stderr)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[Chat] Body: %.500s...", _dumps(body))
     
-    # Disable streaming for now
-    if body.get("stream"):
-        body["stream"] = False
-        print("[Chat] Disabled streaming", file=sys.stderr)
-
     messages = body.get("messages", [])
     if not isinstance(messages, list):
         raise HTTPException(status_code=400, detail="messages must be a list")
 
     model = body.get("model", DEFAULT_MODEL)
-    print(f"[Chat] Model: {model}", file=sys.stderr)
+    logger.debug("[Chat] Model: %s", model)
     
     tools = await _mcp_tools()
-    print(f"[Chat] Got {len(tools)} tools from MCP", file=sys.stderr)
+    logger.debug("[Chat] Got %d tools from MCP", len(tools))
 
     # Build payload for Ollama (OpenAI compatible format)
     payload = {
@@ -321,20 +685,25 @@ async def chat_completions(req: Request) -> Dict[str, Any]:
         payload["tools"] = tools
         payload["tool_choice"] = body.get("tool_choice", "auto")
 
-    print(f"[Chat] Sending to Ollama...", file=sys.stderr)
+    if body.get("stream"):
+        logger.debug("[Chat] Streaming to client...")
+        return StreamingResponse(_stream_chat(payload, messages), media_type="text/event-stream")
+
+    logger.debug("[Chat] Sending to Ollama...")
     try:
         last = await _ollama_chat(payload)
-        print(f"[Chat] Got response: {json.dumps(last, ensure_ascii=False)[:300]}...", file=sys.stderr)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[Chat] Got response: %.300s...", _dumps(last))
     except Exception as e:
-        print(f"[Chat] Error from Ollama: {e}", file=sys.stderr)
+        logger.error("[Chat] Error from Ollama: %s", e)
         raise
     
-    print(f"[Chat] Got response, choices: {len(last.get('choices', []))}", file=sys.stderr)
+    logger.debug("[Chat] Got response, choices: %d", len(last.get("choices", [])))
 
     for i in range(MAX_TOOL_ROUNDS):
         choices = last.get("choices", [])
         if not choices:
-            print(f"[Chat] No choices, returning", file=sys.stderr)
+            logger.debug("[Chat] No choices, returning")
             return last
 
         msg = choices[0].get("message", {})
@@ -342,55 +711,21 @@ async def chat_completions(req: Request) -> Dict[str, Any]:
         tool_calls = msg.get("tool_calls", [])
 
         if content:
-            print(f"[Chat] Round {i}: Has content, returning", file=sys.stderr)
-            if tool_calls:
-                return last
-            else:
-                return last
+            logger.debug("[Chat] Round %d: Has content, returning", i)
+            return last
 
         if not tool_calls:
-            print(f"[Chat] Round {i}: No tool calls, returning", file=sys.stderr)
+            logger.debug("[Chat] Round %d: No tool calls, returning", i)
             return last
 
-        print(f"[Chat] Round {i}: {len(tool_calls)} tool calls", file=sys.stderr)
-        messages.append(msg)
+        logger.debug("[Chat] Round %d: %d tool calls", i, len(tool_calls))
+        # Only role + tool_calls are needed in the history re-sent next round
+        messages.append({"role": "assistant", "tool_calls": tool_calls})
 
-        async with _mcp_lock:
-            for tc in tool_calls:
-                fn = tc.get("function", {})
-                name = fn.get("name", "")
-                args_raw = fn.get("arguments", "{}")
-                try:
-                    args = json.loads(args_raw) if isinstance(args_raw, str) else args_raw
-                except Exception:
-                    args = {}
-
-                print(f"[Chat] Calling tool: {name}", file=sys.stderr)
-                result = await _call_tool(name, args)
-                print(f"[Chat] Tool result: {str(result)[:200]}...", file=sys.stderr)
-                
-                if isinstance(result, list):
-                    result_text = ""
-                    for item in result:
-                        if isinstance(item, dict) and "text" in item:
-                            result_text += item["text"]
-                        elif isinstance(item, str):
-                            result_text += item
-                        else:
-                            result_text += json.dumps(item, ensure_ascii=False)
-                    result_text = result_text.strip()
-                elif isinstance(result, dict):
-                    result_text = json.dumps(result, ensure_ascii=False, indent=2)
-                else:
-                    result_text = str(result)
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.get("id", ""),
-                    "content": result_text
-                })
+        await _run_tool_calls(tool_calls, messages)
 
         payload["messages"] = messages
         last = await _ollama_chat(payload)
 
-    print(f"[Chat] Max rounds reached, returning", file=sys.stderr)
+    logger.debug("[Chat] Max rounds reached, returning")
     return last
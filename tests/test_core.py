@@ -0,0 +1,321 @@
+# core 层测试
+#
+# 固化 M-Token varint 编解码、响应解析与 execute_m_logic 入参校验的行为。
+# 不依赖串口硬件（校验失败的路径在发送前就返回）。
+# 运行：cd tests && python -m pytest test_core.py -v
+
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加 python/MCP 到路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "python" / "MCP"))
+
+import pytest
+
+import core
+from types import SimpleNamespace
+from core import encode_varint, decode_varint, parse_response, execute_m_logic
+
+
+def _reference_encode(tokens):
+    """逐字节的参考实现，用于对照各个快速路径。"""
+    out = bytearray()
+    for t in tokens:
+        v = (t << 1) ^ (t >> 63) if t < 0 else t
+        while v > 0x7F:
+            out.append((v & 0x7F) | 0x80)
+            v >>= 7
+        out.append(v)
+    return bytes(out)
+
+
+# ---------------------------------------------------------------------------
+# 零、设备拓扑 / VM 状态
+# ---------------------------------------------------------------------------
+
+def test_hardware_topology_is_shared_constant():
+    topo = core.get_hardware_topology()
+    assert topo is core.get_hardware_topology()
+    assert [d["id"] for d in topo["devices"]] == [1, 2, 3, 5, 6]
+
+
+def test_read_vm_state_stack_depth():
+    assert core.read_vm_state(4)["stack"] == (0, 0, 0, 0)
+    assert core.read_vm_state(0)["stack"] == (0,)
+    assert core.read_vm_state(4)["stack"] is core.read_vm_state(4)["stack"]
+
+
+# ---------------------------------------------------------------------------
+# 一、varint 编码
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("value", [0, 1, 0x7F, 0x80, 0xFF, 0x3FFF, 0x4000, 0x1FFFFF, 2**32, 2**63 - 1])
+def test_encode_uvarint_matches_reference(value):
+    assert core._encode_uvarint(value) == _reference_encode([value])
+
+
+def test_encode_uvarint_rejects_negative():
+    with pytest.raises(ValueError):
+        core._encode_uvarint(-1)
+
+
+def test_encode_varint_water_level_program():
+    assert encode_varint([80, 1, 71, 1, 82]).hex() == "5001470152"
+
+
+def test_encode_varint_mixed_widths():
+    tokens = [0, 127, 128, 255, 300, 16383, 16384, 2**40, -1, -64, -65]
+    assert encode_varint(tokens) == _reference_encode(tokens)
+
+
+def test_encode_varint_beyond_uint64():
+    tokens = [2**200, 1]
+    assert encode_varint(tokens) == _reference_encode(tokens)
+
+
+def test_encode_varint_empty():
+    assert encode_varint([]) == b""
+
+
+# ---------------------------------------------------------------------------
+# 二、varint 解码 / 响应解析
+# ---------------------------------------------------------------------------
+
+def test_decode_roundtrip():
+    tokens = [0, 1, 127, 128, 255, 300, 16384, 2**35]
+    assert decode_varint(encode_varint(tokens)) == tokens
+
+
+def test_decode_all_single_byte():
+    assert decode_varint(bytes([80, 1, 71, 1, 82])) == [80, 1, 71, 1, 82]
+    assert decode_varint(bytearray(b"\x00\x7f")) == [0, 127]
+    assert decode_varint(b"") == []
+    assert decode_varint(memoryview(b"\x50\x01\x52")) == [80, 1, 82]
+    assert decode_varint([0x80, 0x01, 5]) == [128, 5]
+
+
+@pytest.mark.parametrize("value", [0, 0x7F, 0x80, 0x3FFF, 0x4000, 0x1FFFFF, 0x200000, 2**40])
+def test_decode_uvarint_at_offset(value):
+    data = b"\x05" + encode_varint([value]) + b"\x06"
+    assert core._decode_uvarint(data, 1) == (value, len(data) - 1)
+    assert core._decode_uvarint(data[:-1], 1) == (value, len(data) - 1)
+
+
+def test_decode_truncated_raises():
+    with pytest.raises(ValueError):
+        decode_varint(b"\x80")
+
+
+def test_parse_response_completed():
+    r = parse_response(encode_varint([512, 7]) + b"\x01")
+    assert r["completed"] is True
+    assert r["result"] == 512
+    assert r["steps"] == 7
+
+
+def test_parse_response_fault():
+    r = parse_response(encode_varint([14, 3]) + b"\x00")
+    assert r["completed"] is False
+    assert r["fault"] == "UNAUTHORIZED"
+    assert r["pc"] == 3
+
+
+@pytest.mark.parametrize("code,name", [(1, "STACK_OVERFLOW"), (22, "CALL_DEPTH_LIMIT"), (99, "GAS_LIMIT"), (0, "UNKNOWN_0"), (23, "UNKNOWN_23")])
+def test_parse_response_fault_names(code, name):
+    assert parse_response(encode_varint([code, 0]) + b"\x00")["fault"] == name
+
+
+def test_parse_response_bad_varint():
+    assert "error" in parse_response(b"\x80\x01")
+
+
+def test_parse_response_empty():
+    assert "error" in parse_response(b"")
+
+
+# ---------------------------------------------------------------------------
+# 三、IO / 能力扫描
+# ---------------------------------------------------------------------------
+
+def test_uses_io():
+    assert core.uses_io([80, 1, 71, 1, 82]) is True
+    assert core.uses_io([30, 5, 82]) is False
+    assert core.uses_io([300, 70]) is True  # 超出 0-255 时走逐个比较
+    assert core.uses_io(["30", "71"]) is True  # 字符串 token 按 int() 比较
+    assert core.uses_io(t for t in [300, 30, 71]) is True  # 生成器只走一遍逐项循环
+    assert core.uses_io(t for t in [30, 82]) is False
+
+
+def test_needs_capability():
+    assert core.needs_capability([80, 1, 71, 1, 82], 1) is True
+    assert core.needs_capability([80, 2, 71, 1, 82], 1) is False
+    assert core.needs_capability([80, 1, 82], 300) is False
+    assert core.needs_capability([80, 300, 82], 300) is True
+    assert core.needs_capability([80, 1, 82], 1.0) is True
+    assert core.needs_capability((80, 2, 82), 2) is True
+
+
+# ---------------------------------------------------------------------------
+# 四、execute_m_logic 入参校验（发送前拦截）
+# ---------------------------------------------------------------------------
+
+def test_execute_rejects_empty():
+    assert execute_m_logic([])["code"] == "INVALID_INPUT"
+
+
+def test_execute_rejects_string_token():
+    r = execute_m_logic([80, 1, "water", 71, 1, 82])
+    assert r["code"] == "INVALID_TYPE"
+    assert "water" in r["hint"]
+
+
+def test_execute_rejects_out_of_range():
+    assert execute_m_logic([80, 256])["code"] == "TOKEN_RANGE"
+    assert execute_m_logic([80, -1])["code"] == "TOKEN_RANGE"
+
+
+def test_execute_rejects_non_int_tokens():
+    assert execute_m_logic([80, 1.0, 82])["code"] == "INVALID_TYPE"
+    assert execute_m_logic([80, None, 82])["code"] == "INVALID_TYPE"
+    assert execute_m_logic([80, 1, 71, [1], 82])["code"] == "INVALID_TYPE"
+
+
+def test_execute_rejects_reserved_opcode():
+    assert execute_m_logic([77, 82])["code"] == "BAD_OPCODE"
+
+
+def test_execute_requires_gtway_for_io():
+    r = execute_m_logic([71, 1, 82])
+    assert r["code"] == "UNAUTHORIZED_IO"
+    assert r["device_id"] == 1
+
+
+def test_execute_io_scan_handles_adjacent_opcodes():
+    # IOW 的操作数恰好是 IOR(71)：两处都要按 IO 目标检查
+    r = execute_m_logic([80, 1, 70, 71, 1, 82])
+    assert r["code"] == "UNAUTHORIZED_IO"
+    assert r["device_id"] == 71
+
+
+def test_execute_sends_encoded_bytecode(monkeypatch):
+    sent = {}
+
+    def fake_send(bytecode, timeout_ms):
+        sent["bytecode"] = bytecode
+        return {"completed": True}
+
+    monkeypatch.setattr(core, "_serial_send", fake_send)
+    tokens = [80, 1, 30, 200, 71, 1, 82]
+    assert execute_m_logic(tokens)["completed"] is True
+    assert sent["bytecode"] == encode_varint(tokens)
+    assert execute_m_logic(tuple(tokens))["completed"] is True
+    assert sent["bytecode"] == encode_varint(tokens)
+
+
+# ---------------------------------------------------------------------------
+# 五、串口往返（假串口）
+# ---------------------------------------------------------------------------
+
+class FakeSerial:
+    """每次读空后回放同一帧响应的假串口，记录打开次数与写入内容。"""
+
+    opened = 0
+    payload = encode_varint([42, 5]) + b"\x01"
+
+    def __init__(self, port, baudrate, timeout):
+        FakeSerial.opened += 1
+        self.is_open = True
+        self.timeout = timeout
+        self.written = bytearray()
+        self._rx = bytearray()
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def read(self, n):
+        if not self._rx:
+            self._rx += len(self.payload).to_bytes(4, "little") + self.payload
+        out = bytes(self._rx[:n])
+        del self._rx[:n]
+        return out
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def fake_serial(monkeypatch):
+    FakeSerial.opened = 0
+    monkeypatch.setattr(core, "serial", SimpleNamespace(Serial=FakeSerial))
+    monkeypatch.setattr(core.time, "sleep", lambda _s: None)
+    monkeypatch.setenv("MCP_SERIAL_PORT", "COM_TEST")
+    monkeypatch.setenv("MCP_BAUD", "115200")
+    core._SERIAL_CACHE.clear()
+    yield FakeSerial
+    core._SERIAL_CACHE.clear()
+
+
+def test_serial_connection_is_reused(fake_serial):
+    for _ in range(3):
+        r = execute_m_logic([80, 1, 71, 1, 82])
+        assert r["completed"] is True
+        assert r["result"] == 42
+    assert fake_serial.opened == 1
+    ser = core._SERIAL_CACHE[("COM_TEST", 115200)]
+    assert ser.written.count(encode_varint([80, 1, 71, 1, 82])) == 3
+
+
+def test_execute_async_uses_same_connection(fake_serial):
+    async def run():
+        return await asyncio.gather(*(core.execute_m_logic_async([80, 1, 71, 1, 82]) for _ in range(4)))
+
+    results = asyncio.run(run())
+    assert all(r["result"] == 42 for r in results)
+    assert fake_serial.opened == 1
+
+
+# ---------------------------------------------------------------------------
+# 六、串口探测（假 list_ports）
+# ---------------------------------------------------------------------------
+
+def _port(device, description="n/a", manufacturer=None, hwid="n/a"):
+    return SimpleNamespace(
+        device=device, description=description, manufacturer=manufacturer, hwid=hwid,
+        product=None, vid=None, pid=None, serial_number=None,
+    )
+
+
+def test_detect_serial_ports_prefers_usb_uart(monkeypatch):
+    ports = [
+        _port("COM1", "Communications Port"),
+        _port("COM4", "Standard Serial over Bluetooth link", "Microsoft", "BTHENUM"),
+        _port("COM3", "USB-SERIAL CH340 (COM3)", "wch.cn", "USB VID:PID=1A86:7523"),
+    ]
+    monkeypatch.setattr(core, "_list_ports", SimpleNamespace(comports=lambda: ports))
+    r = core.detect_serial_ports()
+    assert r["status"] == "detected"
+    assert r["total_ports"] == 3
+    assert [p["device"] for p in r["esp8266_candidates"]] == ["COM3"]
+    assert r["suggested_port"]["device"] == "COM3"
+
+
+def test_detect_serial_ports_accepts_enumerated_ports(monkeypatch):
+    def fail():
+        raise AssertionError("should not enumerate")
+
+    monkeypatch.setattr(core, "_list_ports", SimpleNamespace(comports=fail))
+    r = core.detect_serial_ports([_port("/dev/ttyUSB0", "CP2102 USB to UART", "Silicon Labs")])
+    assert r["suggested_port"]["device"] == "/dev/ttyUSB0"
+
+
+def test_detect_serial_ports_without_pyserial(monkeypatch):
+    monkeypatch.setattr(core, "_list_ports", None)
+    assert core.detect_serial_ports()["status"] == "error"
@@ -0,0 +1,152 @@
+# tool_router 流式路径测试
+#
+# 用 httpx.MockTransport 假扮 Ollama、用假 MCP 会话执行工具，不需要真实服务。
+# 运行：cd tests && python -m pytest test_router.py -v
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace as NS
+
+# 添加 python/tool_router 到路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "python" / "tool_router"))
+
+import httpx
+import pytest
+
+import router
+
+
+def _sse(*chunks):
+    body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+    return body.encode()
+
+
+def _delta(finish_reason=None, **delta):
+    return {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+_TOOL_DELTA = [{"index": 0, "id": "c1", "function": {"name": "a", "arguments": '{"x":1}'}}]
+
+
+class FakeSession:
+    def __init__(self):
+        self.calls = []
+
+    async def call_tool(self, name, args):
+        self.calls.append((name, args))
+        return NS(content=[NS(type="text", text=f"{name}:{args}")])
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """按轮次返回预设的 SSE 响应，并记录每轮请求体"""
+    rounds = []
+    responses = []
+
+    def handler(req):
+        rounds.append(json.loads(req.content))
+        return httpx.Response(200, content=responses[len(rounds) - 1])
+
+    monkeypatch.setattr(router, "_http", None)
+    monkeypatch.setattr(router, "_new_http_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    session = FakeSession()
+    monkeypatch.setattr(router, "_mcp_session", session)
+    return responses, rounds, session
+
+
+def _collect(payload, messages):
+    async def run():
+        return [chunk async for chunk in router._stream_chat(payload, messages)]
+    return b"".join(asyncio.run(run())).decode()
+
+
+def _contents(text):
+    out = []
+    for line in text.splitlines():
+        if line.startswith("data: {"):
+            choices = json.loads(line[6:]).get("choices") or [{}]
+            out.append(choices[0].get("delta", {}).get("content"))
+    return [c for c in out if c]
+
+
+def test_stream_forwards_content_and_runs_tools_from_same_round(upstream):
+    """同一轮既有内容又有工具调用：内容照常转发，工具仍会执行"""
+    responses, rounds, session = upstream
+    responses += [
+        _sse(_delta(content="checking "), _delta(tool_calls=_TOOL_DELTA),
+             _delta(content="now"), _delta(finish_reason="tool_calls")),
+        _sse(_delta(content="done"), _delta(finish_reason="stop")),
+    ]
+    messages = [{"role": "user", "content": "hi"}]
+    text = _collect({"model": "m", "messages": messages}, messages)
+
+    assert _contents(text) == ["checking ", "now", "done"]
+    assert text.count("data: [DONE]") == 1
+    assert '"tool_calls"' not in text
+    assert session.calls == [("a", {"x": 1})]
+    assistant, tool = rounds[1]["messages"][-2:]
+    assert assistant["content"] == "checking now"
+    assert assistant["tool_calls"][0]["function"]["name"] == "a"
+    assert tool == {"role": "tool", "tool_call_id": "c1", "content": "a:{'x': 1}"}
+
+
+def test_stream_without_tool_calls_passes_finish_chunk(upstream):
+    responses, rounds, session = upstream
+    responses.append(_sse(_delta(content="plain"), _delta(finish_reason="stop")))
+    messages = [{"role": "user", "content": "hi"}]
+    text = _collect({"model": "m", "messages": messages}, messages)
+
+    assert _contents(text) == ["plain"]
+    assert '"finish_reason": "stop"' in text
+    assert len(rounds) == 1 and not session.calls
+
+
+def test_stream_releases_ollama_slot_before_client_reads(upstream, monkeypatch):
+    """上游读完即归还并发名额，不随下游客户端的读取速度占用"""
+    responses, _, _ = upstream
+    responses.append(_sse(*(_delta(content=f"p{i}") for i in range(5)), _delta(finish_reason="stop")))
+
+    async def run():
+        monkeypatch.setattr(router, "_ollama_sem", asyncio.Semaphore(1))
+        messages = [{"role": "user", "content": "hi"}]
+        gen = router._stream_chat({"model": "m", "messages": messages}, messages)
+        first = await gen.__anext__()
+        for _ in range(50):
+            if not router._ollama_sem.locked():
+                break
+            await asyncio.sleep(0.01)
+        released = not router._ollama_sem.locked()
+        rest = [chunk async for chunk in gen]
+        return first, released, rest
+
+    first, released, rest = asyncio.run(run())
+    assert b"p0" in first
+    assert released
+    assert rest[-1] == b"data: [DONE]\n\n"
+
+
+def test_stream_reports_upstream_failure_in_band(upstream, monkeypatch):
+    def handler(req):
+        raise httpx.ConnectError("refused")
+
+    monkeypatch.setattr(router, "_new_http_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    messages = [{"role": "user", "content": "hi"}]
+    text = _collect({"model": "m", "messages": messages}, messages)
+    err = json.loads(text.splitlines()[0][6:])["error"]
+    assert err["upstream_status"] == 502 and "refused" in err["message"]
+    assert text.endswith("data: [DONE]\n\n")
+
+
+# ---------------------------------------------------------------------------
+# 请求体序列化
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("extra", [{}, {"model": "m", "messages": [], "tool_choice": "auto"}])
+def test_payload_bytes_splices_cached_tools(monkeypatch, extra):
+    """复用缓存的工具 JSON 拼接请求体，结果须与直接序列化等价（含只有 tools 的情形）"""
+    tools = [{"type": "function", "function": {"name": "a"}}]
+    monkeypatch.setattr(router, "_tools_cache", (0.0, tools, router._dumpb(tools)))
+    payload = {"tools": tools, **extra}
+    assert json.loads(router._payload_bytes(payload)) == payload
@@ -0,0 +1,243 @@
+# server 层测试
+#
+# 固化合并读（_read_devices_batch）的 M-Token 程序、结果解包与回退逐设备读的行为。
+# execute_m_logic 被替换为假实现，不依赖串口硬件；审计在导入前关闭。
+# 运行：cd tests && python -m pytest test_server.py -v
+
+import os
+import sys
+import threading
+from pathlib import Path
+
+# 添加 python/MCP 到路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "python" / "MCP"))
+os.environ["MCP_AUDIT_ENABLED"] = "0"
+
+import pytest
+
+import server
+
+
+# (1,2,3) 的合并读程序：先 GTWAY 全部设备，再逐个 IOR+127 拼进 12 bit 字段
+_BATCH_PROGRAM_123 = [
+    80, 1, 80, 2, 80, 3,
+    71, 1, 30, 254, 50,
+    30, 128, 64, 52, 52, 71, 2, 30, 254, 50, 50,
+    30, 128, 64, 52, 52, 71, 3, 30, 254, 50, 50,
+    82,
+]
+
+
+def _pack(*values):
+    packed = 0
+    for v in values:
+        packed = (packed << 12) | (v + 127)
+    return packed
+
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    """每个用例都从“支持合并读、熔断全闭合”开始"""
+    monkeypatch.setattr(server, "_batch_read_supported", True)
+    server._reset_circuits("all")
+    yield
+    server._reset_circuits("all")
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """替换 execute_m_logic，记录下发的 token 程序；responder 决定返回值"""
+    log = []
+    state = {"responder": lambda tokens: {"completed": True, "result": 0, "steps": 1}}
+
+    def fake(m_tokens, timeout_ms=5000):
+        log.append(list(m_tokens))
+        return dict(state["responder"](list(m_tokens)))
+
+    monkeypatch.setattr(server, "execute_m_logic", fake)
+    return log, state
+
+
+def test_batch_read_program_for_three_devices(calls):
+    log, state = calls
+    state["responder"] = lambda tokens: {"completed": True, "result": _pack(0, 0, 0), "steps": 30}
+    server._read_devices_batch((1, 2, 3))
+    assert log == [_BATCH_PROGRAM_123]
+
+
+def test_batch_read_decodes_packed_result_with_negative_temperature(calls):
+    _, state = calls
+    state["responder"] = lambda tokens: {"completed": True, "result": _pack(512, -5, 40), "steps": 30}
+    out = server._read_devices_batch((1, 2, 3))
+    assert [r["result"] for r in out] == [512, -5, 40]
+    assert all(r["completed"] and r["batched"] for r in out)
+
+
+def test_batch_read_decodes_sensor_sentinels(calls):
+    """传感器无效值 -127 / -1 解包后保持原值，快照据此判定无效"""
+    _, state = calls
+    state["responder"] = lambda tokens: {"completed": True, "result": _pack(0, -127, -1), "steps": 30}
+    out = server._read_devices_batch((1, 2, 3))
+    assert [r["result"] for r in out] == [0, -127, -1]
+
+
+def test_batch_read_serial_failure_counts_against_circuits(calls):
+    """串口失败不关闭合并读，但计入每个设备的熔断，并直接给出失败结果"""
+    log, state = calls
+    state["responder"] = lambda tokens: {"completed": False, "code": "TIMEOUT_RESP", "error": "timeout"}
+    out = server._read_devices_batch((1, 2, 3))
+    assert server._batch_read_supported is True
+    assert [r["code"] for r in out] == ["TIMEOUT_RESP"] * 3
+    assert not any(r.get("completed") for r in out)
+    assert len(log) == 1
+    for device_id in (1, 2, 3):
+        assert server._circuit_state[server._circuit_key("read", device_id)].state[1] == 1
+
+
+@pytest.mark.parametrize("response", [
+    {"completed": False, "fault": "STEP_LIMIT", "fault_code": 11, "pc": 20},
+    {"error": "bad response varint: truncated"},
+    {"error": "pyserial not installed", "code": "MISSING_DEP"},
+])
+def test_batch_read_transient_failure_keeps_batching(calls, response):
+    """偶发 VM 故障、无法解析的响应等只回退本次，不关闭合并读"""
+    _, state = calls
+    state["responder"] = lambda tokens: response
+    assert server._read_devices_batch((1, 2, 3)) is None
+    assert server._batch_read_supported is True
+
+
+@pytest.mark.parametrize("fault", ["UNKNOWN_OP", "BAD_ENCODING"])
+def test_vm_fault_disables_batching_and_snapshot_falls_back(calls, monkeypatch, fault):
+    log, state = calls
+    readings = {1: 512, 2: -5, 3: 40, 5: 0, 6: 1}
+
+    def responder(tokens):
+        if tokens == _BATCH_PROGRAM_123:
+            return {"completed": False, "fault": fault, "pc": 11}
+        return {"completed": True, "result": readings[tokens[1]], "steps": 3}
+
+    state["responder"] = responder
+    monkeypatch.setattr(server, "_ensure_serial_port", lambda: "COM_TEST")
+
+    out = server.read_environment_snapshot_mcp(samples=2, sample_interval_ms=0)
+    assert server._batch_read_supported is False
+    assert out["status"] == "success"
+    assert out["water_level_raw_values"] == [512, 512]
+    assert out["temperature_c_values"] == [-5, -5]
+    assert out["humidity_pct_values"] == [40, 40]
+    # 合并读只试一次，之后全部走逐设备 IOR 程序
+    assert log.count(_BATCH_PROGRAM_123) == 1
+    single_reads = [t for t in log if t != _BATCH_PROGRAM_123]
+    assert sorted(t[1] for t in single_reads if t[1] in (1, 2, 3)) == [1, 1, 2, 2, 3, 3]
+    assert all(t == [80, t[1], 71, t[1], 82] for t in single_reads)
+
+
+def test_snapshot_skips_per_device_reads_after_batch_serial_failure(calls, monkeypatch):
+    log, state = calls
+
+    def responder(tokens):
+        if tokens == _BATCH_PROGRAM_123:
+            return {"completed": False, "code": "TIMEOUT_RESP", "error": "timeout"}
+        return {"completed": True, "result": 0, "steps": 3}
+
+    state["responder"] = responder
+    monkeypatch.setattr(server, "_ensure_serial_port", lambda: "COM_TEST")
+
+    out = server.read_environment_snapshot_mcp(samples=1, sample_interval_ms=0)
+    assert out["status"] == "failed"
+    assert [e["device_id"] for e in out["errors"]] == [1, 2, 3]
+    # 环境设备没有再被逐个读取（之后只剩继电器状态读）
+    assert not any(t[1] in (1, 2, 3) for t in log if t != _BATCH_PROGRAM_123)
+
+
+# ---------------------------------------------------------------------------
+# 健康报告
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def health_tools(monkeypatch):
+    """替换健康报告依赖的自检与串口配置检查，按调用顺序记录"""
+    order = []
+
+    def self_check(**_kw):
+        order.append("self_check")
+        return {"status": "success", "health_status": "ok"}
+
+    def serial_cfg():
+        order.append("serial_config")
+        return {"status": "ok"}
+
+    monkeypatch.setattr(server, "device_self_check_mcp", self_check)
+    monkeypatch.setattr(server, "check_serial_config_mcp", serial_cfg)
+    monkeypatch.setattr(server, "_health_check_fut", None)
+    return order
+
+
+def test_health_report_reads_serial_config_after_self_check(health_tools):
+    out = server.mcp_health_report_mcp()
+    assert health_tools == ["self_check", "serial_config"]
+    assert out["overall_health"] == "ok"
+    assert out["serial_status"] == "ok"
+    # 健康路径下 open_circuits 仍以空列表给出
+    assert out["open_circuits"] == []
+    assert out["open_circuit_count"] == 0
+
+
+def test_health_report_reuses_timed_out_self_check(health_tools, monkeypatch):
+    """超时的自检仍在跑时，后续报告等待同一次自检而不是在池里排队"""
+    release = threading.Event()
+    started = []
+
+    def stuck_self_check(**_kw):
+        started.append(1)
+        release.wait(5)
+        return {"status": "success", "health_status": "ok"}
+
+    monkeypatch.setattr(server, "device_self_check_mcp", stuck_self_check)
+    monkeypatch.setattr(server, "_HEALTH_SELF_CHECK_TIMEOUT_SEC", 0.05)
+    try:
+        for _ in range(3):
+            out = server.mcp_health_report_mcp()
+            assert out["overall_health"] == "failed"
+            assert "timed out" in out["components"]["self_check"]["error"]
+        assert len(started) == 1
+    finally:
+        release.set()
+        server._health_check_fut.result(timeout=5)
+
+
+def test_device_self_check_reads_serial_config_after_detection(monkeypatch):
+    order = []
+
+    def detect():
+        order.append("detect")
+        return {"status": "success"}
+
+    def serial_cfg():
+        order.append("serial_config")
+        return {"status": "ok"}
+
+    monkeypatch.setattr(server, "detect_and_connect_mcp", detect)
+    monkeypatch.setattr(server, "check_serial_config_mcp", serial_cfg)
+    monkeypatch.setattr(server, "read_environment_snapshot_mcp", lambda **_kw: {"status": "success"})
+    out = server.device_self_check_mcp()
+    assert order == ["detect", "serial_config"]
+    assert out["health_status"] == "ok"
+
+
+# ---------------------------------------------------------------------------
+# 熔断
+# ---------------------------------------------------------------------------
+
+def test_reset_all_circuits_keeps_entry_identity():
+    """全量复位原地清零：已取得条目引用的并发失败路径不会写到游离对象上"""
+    key = server._circuit_key("read", 1)
+    server._circuit_on_failure("read", 1, reason="test")
+    entry = server._circuit_state[key]
+    assert entry.state[1] == 1
+    assert key in server._reset_circuits("all")
+    assert server._circuit_state[key] is entry
+    assert entry.state == server._CIRCUIT_CLEAN
+    server._circuit_on_failure("read", 1, reason="test")
+    assert server._circuit_state[key].state[1] == 1
@@ -4,6 +4,8 @@
 # 运行：cd tests && python -m pytest test_skills.py -v
 
 import sys
+import threading
+import time
 from pathlib import Path
 from unittest.mock import MagicMock
 
@@ -125,6 +127,45 @@ def test_patrol_skill_includes_audit(engine):
     assert len(r["recent_audit"]["events"]) == 1
 
 
+def test_patrol_skill_keeps_empty_audit_events(engine):
+    """没有审计事件时 events 仍是空列表，调用方可直接索引"""
+    eng, tools = engine
+    tools["recent_audit"].return_value = {"status": "success", "events": [], "count": 0}
+    r = eng.run_patrol_skill()
+    assert r["recent_audit"] == {"count": 0, "events": []}
+
+
+@pytest.mark.parametrize("include_relay_write_check", [False, True])
+def test_patrol_skill_self_check_runs_first(engine, include_relay_write_check):
+    """自检先单独跑完；健康报告与审计读取随后并发下发"""
+    eng, tools = engine
+    order = []
+    barrier = threading.Barrier(2, timeout=2)
+
+    def self_check(**_kw):
+        time.sleep(0.05)  # 若与其它工具并发，它们会先记下
+        order.append("device_self_check")
+        return tools["device_self_check"].return_value
+
+    def wait_then(name, result):
+        def _fn(**_kw):
+            order.append(name)
+            barrier.wait()  # 两者须同时在跑，否则超时
+            return result
+        return _fn
+
+    tools["device_self_check"].side_effect = self_check
+    for name in ("health_report", "recent_audit"):
+        tools[name].side_effect = wait_then(name, tools[name].return_value)
+    r = eng.run_patrol_skill(include_relay_write_check=include_relay_write_check)
+    assert r["overall_health"] == "ok"
+    assert order[0] == "device_self_check"
+    assert sorted(order[1:]) == ["health_report", "recent_audit"]
+    tools["device_self_check"].assert_called_once_with(
+        include_relay_write_check=include_relay_write_check, timeout_ms=4000
+    )
+
+
 # ---------------------------------------------------------------------------
 # 环境评估技能
 # ---------------------------------------------------------------------------